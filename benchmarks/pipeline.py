@@ -0,0 +1,595 @@
+"""Offline benchmarks for the download -> decode -> play pipeline.
+
+Runs the voice cog without Discord or the network. Songs are local
+audio fixtures generated with ffmpeg and served by a stand-in for
+yt-dlp, and playback goes to a stub voice client that reads the
+audio as fast as the source produces it.
+
+Usage:
+    python benchmarks/pipeline.py [--output results.json]
+
+Requires ffmpeg in PATH. Results are printed as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, suppress
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+# Settings are read from the environment on first use,
+# so they have to be set before importing the bot.
+WORKDIR = Path(tempfile.mkdtemp(prefix="bnss-bench-"))
+os.environ.setdefault("BNSS_TOKEN", "benchmark")
+os.environ.setdefault("BNSS_CACHE_DIR", str(WORKDIR / "cache"))
+os.environ.setdefault("BNSS_SPILL_DIR", str(WORKDIR / "spill"))
+os.environ.setdefault("BNSS_CATALOG_PATH", str(WORKDIR / "catalog.sqlite3"))
+os.environ.setdefault("BNSS_SNAPSHOT_DIR", str(WORKDIR / "snapshots"))
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import discord  # noqa: E402
+
+from bnss import __version__  # noqa: E402
+from bnss.audio import (  # noqa: E402
+    FRAME_LENGTH,
+    BufferReader,
+    RampedVolume,
+    create_decoder,
+    np,
+    playback_position,
+    with_volume,
+)
+from bnss.bot import BNSSBot  # noqa: E402
+from bnss.cache import AudioCache, TTLCache  # noqa: E402
+from bnss.cogs.voice import VoiceCog  # noqa: E402
+from bnss.helpers import Song  # noqa: E402
+
+LINK = "https://www.youtube.com/watch?v={}"
+
+# Songs play this many times faster than real time in the transitions bench,
+# so the next song can be decoded ahead like it is in a voice channel
+TRANSITION_SPEED = 10
+
+
+def make_fixture(path: Path, duration: int, frequency: int) -> None:
+    """Encode a sine wave into an opus webm file."""
+
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency={frequency}:duration={duration}",
+            "-ac",
+            "2",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            "128k",
+            str(path),
+        ],
+        check=True,
+    )
+
+
+class FakeYoutubeDL:
+    """Stand-in for `yt_dlp.YoutubeDL` that serves local fixtures.
+
+    Downloads are written to stdout in chunks like yt-dlp does
+    with `outtmpl` set to "-", throttled to `bandwidth` bytes per second.
+    """
+
+    CHUNK = 64 * 1024
+
+    def __init__(self, fixtures: dict[str, Path], bandwidth: int, duration: int):
+        self.fixtures = fixtures
+        self.bandwidth = bandwidth
+        self.duration = duration
+        self.extractions = 0
+        self.downloads = 0
+
+    def extract_info(self, query: str, download: bool = False) -> dict:
+        self.extractions += 1
+
+        key = query.rsplit("=", 1)[-1]
+        path = self.fixtures[key]
+        return {
+            "id": key,
+            "title": f"Fixture {key}",
+            "webpage_url": query,
+            "duration": self.duration,
+            "thumbnail": "",
+            "filesize": path.stat().st_size,
+            "acodec": "opus",
+            "url": str(path),
+        }
+
+    def process_ie_result(self, info: dict, download: bool = True) -> dict:
+        self.downloads += 1
+
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        delay = self.CHUNK / self.bandwidth if self.bandwidth else 0
+
+        with open(info["url"], "rb") as file:
+            while chunk := file.read(self.CHUNK):
+                out.write(chunk)
+                time.sleep(delay)
+
+        return info
+
+
+class StubVoiceClient:
+    """Voice client that reads sources in a thread instead of sending them.
+
+    Frames are read as fast as possible, or `speed` times faster
+    than real time. Songs that start within the same source are
+    recorded as a `switch` with the time the read took.
+    """
+
+    def __init__(self, channel, speed: float = 0):
+        self.channel = channel
+        self.source = None
+        self.speed = speed
+        self.events: list[tuple[str, float]] = []
+
+        self._playing = False
+        self._stop = threading.Event()
+
+    def is_playing(self) -> bool:
+        return self._playing
+
+    def is_paused(self) -> bool:
+        return False
+
+    def is_connected(self) -> bool:
+        return True
+
+    def play(self, source: discord.AudioSource, *, after=None) -> None:
+        if self._playing:
+            raise discord.ClientException("Already playing audio.")
+
+        self.source = source
+        self._playing = True
+        self._stop.clear()
+        self.events.append(("play", time.perf_counter()))
+
+        thread = threading.Thread(target=self._run, args=(source, after), daemon=True)
+        thread.start()
+
+    def _run(self, source: discord.AudioSource, after) -> None:
+        first = True
+        position = None
+        start = time.perf_counter()
+        frames = 0
+
+        while not self._stop.is_set():
+            before = time.perf_counter()
+            if not source.read():
+                break
+
+            now = time.perf_counter()
+            if first:
+                self.events.append(("first_frame", now))
+                first = False
+
+            # The position goes back when the source moved to the next song
+            last, position = position, playback_position(source)
+            if last is not None and position is not None and position < last:
+                self.events.append(("switch", now - before))
+
+            frames += 1
+            if self.speed:
+                delay = start + frames * FRAME_LENGTH / self.speed - now
+                if delay > 0:
+                    time.sleep(delay)
+
+        self.events.append(("end", time.perf_counter()))
+        self._playing = False
+
+        # Same order as discord.py's AudioPlayer
+        if after:
+            after(None)
+
+        # ffmpeg's stdin can already be closed by the pipe writer
+        with suppress(ValueError):
+            source.cleanup()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        self.stop()
+
+    async def wait_for(self, events, count: int, timeout: float = 120) -> None:
+        """Wait until any of `events` was recorded `count` times."""
+
+        if isinstance(events, str):
+            events = (events,)
+
+        deadline = time.perf_counter() + timeout
+        while sum(name in events for name, _ in self.events) < count:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"Timed out waiting for {events}")
+            await asyncio.sleep(0.005)
+
+
+class FakeContext:
+    """Minimal `commands.Context` for calling the cog commands."""
+
+    def __init__(self, guild_id: int, speed: float = 0):
+        channel = SimpleNamespace(id=guild_id, mention=f"#voice-{guild_id}")
+        self.voice = StubVoiceClient(channel, speed)
+        self.channel = SimpleNamespace(id=guild_id)
+        self.guild = SimpleNamespace(id=guild_id, voice_client=self.voice)
+        self.author = SimpleNamespace(
+            name=f"user-{guild_id}",
+            voice=SimpleNamespace(channel=channel),
+        )
+        self.messages: list[str] = []
+
+    async def send(self, content=None, **kwargs) -> None:
+        self.messages.append(content)
+
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+
+class BenchVoiceCog(VoiceCog):
+    """Voice cog that downloads through `FakeYoutubeDL`."""
+
+    def __init__(self, bot: BNSSBot, ytdlp: FakeYoutubeDL):
+        super().__init__(bot)
+        self.fake_ytdlp = ytdlp
+
+    def get_ytdlp(self) -> FakeYoutubeDL:
+        return self.fake_ytdlp
+
+
+def peak_rss() -> int:
+    """Return the peak resident memory of the process in bytes."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def summary(samples: list[float]) -> dict:
+    """Return the statistics of timings in milliseconds."""
+
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[math.ceil(0.95 * len(samples)) - 1] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def first_audio(voice: StubVoiceClient, start: float, nth: int = 1) -> float:
+    """Return the delay between `start` and the nth first frame."""
+
+    frames = [t for name, t in voice.events if name == "first_frame"]
+    return frames[nth - 1] - start
+
+
+def create_source(
+    fp,
+    volume: int,
+    codec: str,
+    passthrough: bool = True,
+    position: float = 0.0,
+    skip: float = 0.0,
+) -> discord.AudioSource:
+    """Create the audio source the player would play a song with."""
+
+    decoder = create_decoder(
+        fp, volume, codec, passthrough, position=position, skip=skip
+    )
+    return with_volume(decoder, volume, passthrough)
+
+
+def bench_ffmpeg_spawn(fixture: Path, rounds: int) -> dict:
+    """Time from creating a source to its first frame, for each playback path."""
+
+    data = fixture.read_bytes()
+    results = {}
+
+    for name, codec, passthrough, volume in (
+        ("opus_passthrough", "opus", True, 100),
+        ("opus_volume", "opus", True, 50),
+        ("pcm", "opus", False, 100),
+    ):
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            source = create_source(BufferReader(data), volume, codec, passthrough)
+            source.read()
+            samples.append(time.perf_counter() - start)
+            source.cleanup()
+
+        results[name] = summary(samples)
+
+    return results
+
+
+def bench_seek(fixture: Path, duration: int, rounds: int) -> dict:
+    """Time from seeking near the end of a song to its first frame."""
+
+    song = Song(codec="opus", data=BytesIO(fixture.read_bytes()))
+    position = max(0, duration - 5)
+
+    results = {}
+    for name, indexed in (("full_decode", False), ("seek_index", True)):
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            if indexed:
+                fp, skip = song.open_at(position)
+            else:
+                fp, skip = song.open(), position
+
+            source = create_source(fp, 100, song.codec, position=position, skip=skip)
+            source.read()
+            samples.append(time.perf_counter() - start)
+
+            # ffmpeg's stdin can already be closed by the pipe writer
+            with suppress(ValueError):
+                source.cleanup()
+
+        results[name] = summary(samples)
+
+    return results
+
+
+class FrameSource(discord.AudioSource):
+    """PCM source replaying frames that were decoded beforehand."""
+
+    def __init__(self, frames: list[bytes]):
+        self.frames = iter(frames)
+
+    def read(self) -> bytes:
+        return next(self.frames, b"")
+
+
+def bench_volume(fixture: Path) -> dict:
+    """Per-frame cost of changing the volume of PCM audio in python."""
+
+    pcm = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(fixture), "-f", "s16le", "-ar", "48000"]
+        + ["-ac", "2", "-"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    size = discord.opus.Encoder.FRAME_SIZE
+    frames = [pcm[i : i + size] for i in range(0, len(pcm) - size + 1, size)]
+
+    transformers = {"pcm_volume_transformer": discord.PCMVolumeTransformer}
+    if np is not None:
+        transformers["ramped_volume"] = RampedVolume
+
+    results = {}
+    for name, transformer in transformers.items():
+        source = transformer(FrameSource(frames), 0.5)
+        start = time.perf_counter()
+        for i in range(len(frames)):
+            # Change the volume once a second, like a busy `!volume`
+            if i % 50 == 0:
+                source.volume = 0.4 if source.volume == 0.5 else 0.5
+            source.read()
+
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "frames": len(frames),
+            "us_per_frame": elapsed / len(frames) * 1e6,
+        }
+
+    return results
+
+
+async def bench_time_to_first_audio(cog: BenchVoiceCog, keys: list[str]) -> dict:
+    """Time from `!play` to the first frame, with a cold and a warm cache."""
+
+    cold, warm = [], []
+    for guild_id, key in enumerate(keys, start=1000):
+        for samples in (cold, warm):
+            ctx = FakeContext(guild_id)
+            start = time.perf_counter()
+            await cog.play.callback(cog, ctx, query=LINK.format(key))
+            await ctx.voice.wait_for("first_frame", 1)
+            samples.append(first_audio(ctx.voice, start))
+
+            ctx.voice.stop()
+            await ctx.voice.wait_for("end", 1)
+            cog.guild_voice.pop(guild_id)
+            cog.prefetcher.forget(guild_id)
+
+    return {"cold_cache": summary(cold), "warm_cache": summary(warm)}
+
+
+async def bench_queue_throughput(cog: BenchVoiceCog, keys: list[str], guilds: int):
+    """Queue every fixture in several guilds at once and time it."""
+
+    contexts = [FakeContext(guild_id) for guild_id in range(2000, 2000 + guilds)]
+
+    async def fill(ctx: FakeContext) -> None:
+        for key in keys:
+            await cog.play.callback(cog, ctx, query=LINK.format(key))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fill(ctx) for ctx in contexts))
+    queued = time.perf_counter() - start
+
+    for ctx in contexts:
+        ctx.voice.stop()
+        cog.guild_voice.pop(ctx.guild.id)
+        cog.prefetcher.forget(ctx.guild.id)
+
+    songs = len(keys) * guilds
+    return {
+        "songs": songs,
+        "guilds": guilds,
+        "seconds": queued,
+        "songs_per_second": songs / queued,
+    }
+
+
+async def bench_transitions(cog: BenchVoiceCog, keys: list[str]) -> dict:
+    """Time the gap between the end of a song and the first frame of the next.
+
+    Songs started without a new source count the read that switched to them.
+    """
+
+    ctx = FakeContext(3000, TRANSITION_SPEED)
+    for key in keys:
+        await cog.play.callback(cog, ctx, query=LINK.format(key))
+
+    await ctx.voice.wait_for(("first_frame", "switch"), len(keys))
+
+    gaps = []
+    last_end = None
+    for name, t in ctx.voice.events:
+        if name == "end":
+            last_end = t
+        elif name == "first_frame" and last_end is not None:
+            gaps.append(t - last_end)
+        elif name == "switch":
+            gaps.append(t)
+
+    ctx.voice.stop()
+    cog.guild_voice.pop(ctx.guild.id)
+    cog.prefetcher.forget(ctx.guild.id)
+
+    return summary(gaps)
+
+
+async def bench_memory(cog: BenchVoiceCog, keys: list[str]) -> dict:
+    """Measure the peak RSS growth per queued and downloaded song."""
+
+    ctx = FakeContext(4000)
+    cog.prefetcher.depth = len(keys)
+
+    before = peak_rss()
+    for key in keys:
+        await cog.play.callback(cog, ctx, query=LINK.format(key))
+
+    # Wait for every song to be downloaded
+    while not all(song.downloaded for song in cog.guild_voice[4000].queue):
+        await asyncio.sleep(0.01)
+
+    after = peak_rss()
+    ctx.voice.stop()
+    cog.guild_voice.pop(ctx.guild.id)
+    cog.prefetcher.forget(ctx.guild.id)
+
+    return {
+        "songs": len(keys),
+        "peak_rss_bytes": after,
+        "peak_rss_growth_bytes": after - before,
+        "bytes_per_song": (after - before) / len(keys),
+        "buffers": cog.buffers.stats(),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    fixtures = {}
+    for i in range(args.songs):
+        path = WORKDIR / f"bench{i}.webm"
+        make_fixture(path, args.duration, 220 + 20 * i)
+        fixtures[f"bench{i}"] = path
+
+    keys = list(fixtures)
+    ytdlp = FakeYoutubeDL(fixtures, args.bandwidth, args.duration)
+
+    bot = BNSSBot()
+    bot.loop = asyncio.get_running_loop()
+    cog = BenchVoiceCog(bot, ytdlp)
+    await cog.cog_load()
+
+    # The background tasks wait for a gateway connection that never comes
+    cog.evict_task.cancel()
+    cog.warm_up_task.cancel()
+    cog.snapshot_task.cancel()
+    cog.resume_task.cancel()
+
+    results = {
+        "version": ".".join(str(part) for part in __version__),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "ffmpeg_spawn": bench_ffmpeg_spawn(fixtures[keys[0]], args.rounds),
+        "volume": bench_volume(fixtures[keys[0]]),
+        "seek": bench_seek(fixtures[keys[0]], args.duration, args.rounds),
+        "time_to_first_audio": await bench_time_to_first_audio(cog, keys),
+    }
+
+    # Start again from an empty cache for the download heavy benchmarks
+    cog.cache = AudioCache(WORKDIR / "cold-cache", bot.settings.cache_max_bytes)
+    cog.info_cache = TTLCache(
+        bot.settings.info_cache_size,
+        bot.settings.info_cache_ttl,
+    )
+
+    results["queue_throughput"] = await bench_queue_throughput(cog, keys, args.guilds)
+    results["transitions"] = await bench_transitions(cog, keys)
+    results["memory"] = await bench_memory(cog, keys)
+    results["cache"] = cog.cache.stats()
+    results["yt_dlp"] = {
+        "extractions": ytdlp.extractions,
+        "downloads": ytdlp.downloads,
+    }
+
+    await cog.cog_unload()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=4, help="number of fixtures")
+    parser.add_argument("--duration", type=int, default=60, help="fixture seconds")
+    parser.add_argument("--guilds", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=10, help="ffmpeg spawns")
+    parser.add_argument(
+        "--bandwidth",
+        type=int,
+        default=4_000_000,
+        help="simulated download speed in bytes per second, 0 for unlimited",
+    )
+    parser.add_argument("--output", type=Path, help="write the results here")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is needed to run the benchmarks.")
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        args.output.write_text(output + "\n")
+
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import threading
+import time
+from typing import Hashable, Optional
+
+from bnss import metrics
+
+
+class SongRejected(Exception):
+    """Raised when a song goes over a limit while it's downloaded.
+
+    `reason` is "duration" or "filesize", like the reasons
+    of `metrics.REJECTED_SONGS`.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Song rejected, its {reason} is over the limit.")
+        self.reason = reason
+
+
+class TokenBucket:
+    """Limit a flow of bytes to `rate` bytes per second.
+
+    Up to `burst` bytes can go through at once after an idle period.
+    Taking more than the bucket holds goes into debt, the caller
+    then sleeps until the debt is paid back, so large writes
+    are throttled as well as small ones.
+    """
+
+    def __init__(self, rate: int, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def full(self) -> bool:
+        with self._lock:
+            self._refill()
+            return self._tokens >= self.burst
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, size: int) -> float:
+        """Take `size` bytes from the bucket, return how long to wait for them."""
+
+        with self._lock:
+            self._refill()
+            self._tokens -= size
+            return max(0.0, -self._tokens / self.rate)
+
+
+class Bandwidth:
+    """Download bandwidth shared by all guilds, with a budget per guild.
+
+    A guild downloading large songs uses up its own budget first,
+    so it can't take the whole global budget from the other guilds.
+    Both budgets are unlimited if their rate isn't set.
+    """
+
+    def __init__(self, rate: Optional[int], guild_rate: Optional[int], burst: int):
+        self.guild_rate = guild_rate
+        self.burst = burst
+        self.bucket = TokenBucket(rate, burst) if rate else None
+
+        self._guilds: dict[Hashable, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def take(self, guild: Hashable, size: int) -> None:
+        """Block until `size` bytes fit in the budgets of `guild`."""
+
+        wait = self.bucket.reserve(size) if self.bucket else 0.0
+
+        if self.guild_rate:
+            with self._lock:
+                bucket = self._guilds.get(guild)
+                if bucket is None:
+                    bucket = self._guilds[guild] = TokenBucket(
+                        self.guild_rate, self.burst
+                    )
+
+            wait = max(wait, bucket.reserve(size))
+
+        if wait:
+            metrics.DOWNLOAD_THROTTLED_SECONDS.inc(wait)
+            time.sleep(wait)
+
+    def forget(self, guild: Hashable) -> None:
+        """Drop the budget of a guild once it's back to full."""
+
+        with self._lock:
+            bucket = self._guilds.get(guild)
+            if bucket is not None and bucket.full:
+                del self._guilds[guild]
+
+
+class LimitedStream:
+    """Writes a download to `target`, within the limits of the bot.
+
+    The download is aborted with `SongRejected` as soon as it goes
+    over `max_bytes`, or over `max_duration` seconds estimated from
+    the bitrate of the song if its duration wasn't known upfront.
+    Every write is throttled by the bandwidth budgets of `guild`.
+    """
+
+    def __init__(
+        self,
+        target,
+        info: dict,
+        guild: Hashable,
+        bandwidth: Bandwidth,
+        max_bytes: Optional[int],
+        max_duration: Optional[int],
+    ):
+        self.target = target
+        self.guild = guild
+        self.bandwidth = bandwidth
+        self.max_bytes = max_bytes
+        self.written = 0
+
+        # The duration of songs without one is estimated from their bitrate in kbit/s
+        bitrate = info.get("abr") or info.get("tbr")
+        self.max_duration_bytes = None
+        if max_duration and not info.get("duration") and bitrate:
+            self.max_duration_bytes = int(max_duration * bitrate * 1000 / 8)
+
+    def write(self, data: bytes) -> int:
+        self.written += len(data)
+        if self.max_bytes and self.written > self.max_bytes:
+            raise SongRejected("filesize")
+
+        if self.max_duration_bytes and self.written > self.max_duration_bytes:
+            raise SongRejected("duration")
+
+        self.bandwidth.take(self.guild, len(data))
+        return self.target.write(data)
+
+    def flush(self) -> None:
+        self.target.flush()
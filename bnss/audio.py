@@ -0,0 +1,854 @@
+import io
+import logging
+import mmap
+import os
+import re
+import subprocess
+import threading
+import time
+import weakref
+from bisect import bisect_right
+from collections import deque
+from typing import IO, Callable, Optional
+
+import discord
+
+from bnss.decoder import Decoder, FFmpegLog
+from bnss.logger import log
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Integrated loudness in the summary of ffmpeg's ebur128 filter
+LOUDNESS_PATTERN = re.compile(rb"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+# Normalization never boosts or cuts more than this, in dB
+MAX_GAIN = 12.0
+
+# Matroska element IDs needed to index clusters by time
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TIMECODE_SCALE = 0x2AD7B1
+EBML_CLUSTER = 0x1F43B675
+EBML_CLUSTER_TIMECODE = 0xE7
+
+# Elements of the segment, a cluster of unknown size ends at the next one
+EBML_TOP_LEVEL = {
+    0x114D9B74,  # SeekHead
+    EBML_INFO,
+    0x1654AE6B,  # Tracks
+    0x1043A770,  # Chapters
+    EBML_CLUSTER,
+    0x1C53BB6B,  # Cues
+    0x1941A469,  # Attachments
+    0x1254C367,  # Tags
+}
+
+# Length of the frames sent to Discord, in seconds
+FRAME_LENGTH = 0.02
+
+# Seconds a decoder can take to produce a frame before it's killed
+DECODER_TIMEOUT = 30
+
+
+class DownloadCancelled(Exception):
+    """Raised when writing to a `StreamBuffer` that was cancelled."""
+
+
+class StreamBuffer:
+    """In-memory audio buffer that can be read while it's being written.
+
+    The downloader writes into it like a file and every reader
+    gets its own cursor, blocking until more data arrives
+    or the download is closed. All the written bytes are kept,
+    so the audio can be played again once the download is done.
+    Songs downloading the same audio share one buffer, it's only
+    cancelled once all of them cancelled their share.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._cond = threading.Condition()
+        self._callbacks: list[tuple[int, Callable[[], None]]] = []
+        self._holders = 1
+        self.closed = False
+        self.cancelled = False
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def write(self, data: bytes) -> int:
+        """Append data and wake up the readers."""
+
+        with self._cond:
+            if self.cancelled:
+                raise DownloadCancelled()
+
+            self._data += data
+            self._cond.notify_all()
+            ready = self._pop_callbacks(len(self._data))
+
+        for callback in ready:
+            callback()
+
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self, abort: bool = False) -> None:
+        """Mark the download as finished.
+
+        If `abort` is set, the pending callbacks are dropped
+        instead of being called with a partial buffer.
+        """
+
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            ready = [] if abort else self._pop_callbacks(None)
+            self._callbacks.clear()
+
+        for callback in ready:
+            callback()
+
+    def share(self) -> bool:
+        """Add a holder to the buffer, unless it's already cancelled."""
+
+        with self._cond:
+            if self.cancelled:
+                return False
+
+            self._holders += 1
+            return True
+
+    def cancel(self) -> None:
+        """Drop a holder, and stop the download once none is left.
+
+        The next write then raises `DownloadCancelled`. The pending
+        callbacks are dropped, nothing should start playing
+        a song that was cancelled.
+        """
+
+        with self._cond:
+            self._holders -= 1
+            if self._holders > 0:
+                return
+
+            self.cancelled = True
+
+        self.close(abort=True)
+
+    def forward(self, other: "StreamBuffer") -> None:
+        """Close the buffer and move its pending callbacks to `other`."""
+
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+            self.closed = True
+            self._cond.notify_all()
+
+        for size, callback in callbacks:
+            other.when_buffered(size, callback)
+
+    def when_buffered(self, size: int, callback: Callable[[], None]) -> None:
+        """Call `callback` once `size` bytes are written or the buffer is closed."""
+
+        with self._cond:
+            if not self.closed and len(self._data) < size:
+                self._callbacks.append((size, callback))
+                return
+
+        callback()
+
+    def _pop_callbacks(self, size: Optional[int]) -> list[Callable[[], None]]:
+        """Remove and return the callbacks that are due at `size`."""
+
+        ready, waiting = [], []
+        for limit, callback in self._callbacks:
+            if size is None or size >= limit:
+                ready.append(callback)
+            else:
+                waiting.append((limit, callback))
+
+        self._callbacks = waiting
+        return ready
+
+    def getvalue(self) -> bytes:
+        """Return all the bytes written so far."""
+
+        with self._cond:
+            return bytes(self._data)
+
+    def getbuffer(self) -> memoryview:
+        """Return a view of the written bytes, once the buffer is closed."""
+
+        return memoryview(self._data)
+
+    def reader(self) -> "StreamReader":
+        """Return a new reader starting at the beginning of the stream."""
+
+        return StreamReader(self)
+
+
+class StreamReader(io.RawIOBase):
+    """Blocking reader over a `StreamBuffer`."""
+
+    def __init__(self, stream: StreamBuffer):
+        self._stream = stream
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        stream = self._stream
+
+        with stream._cond:
+            while self._pos >= len(stream._data) and not stream.closed:
+                stream._cond.wait()
+
+            end = len(stream._data) if size < 0 else self._pos + size
+            chunk = bytes(stream._data[self._pos : end])
+
+        self._pos += len(chunk)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+class BufferReader(io.RawIOBase):
+    """Reader with its own cursor over a buffer shared by other readers."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size < 0 else self._pos + size
+        chunk = self._view[self._pos : end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self._view) - self._pos)
+        if size <= 0:
+            return 0
+
+        buffer[:size] = self._view[self._pos : self._pos + size]
+        self._pos += size
+        return size
+
+
+class MappedAudio:
+    """Read-only memory map of an audio file.
+
+    A file is mapped only once while it's in use, every playback
+    gets its own reader over the same mapping. The mapping stays
+    valid even if the file is removed from the disk.
+    """
+
+    _mapped: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = os.fspath(path)
+
+        with open(self.path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    @classmethod
+    def open(cls, path: str | os.PathLike) -> "MappedAudio":
+        """Return the mapping of a file, mapping it if nobody else did."""
+
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+        with cls._lock:
+            audio = cls._mapped.get(key)
+            if audio is None:
+                audio = cls(path)
+                cls._mapped[key] = audio
+
+        return audio
+
+    @property
+    def data(self) -> mmap.mmap:
+        """Return the mapped bytes of the file."""
+
+        return self._map
+
+    def reader(self) -> BufferReader:
+        """Return a new reader starting at the beginning of the file."""
+
+        return BufferReader(self._map)
+
+
+class SplicedReader(io.RawIOBase):
+    """Reader over several parts of a buffer, one after the other."""
+
+    def __init__(self, buffer, *parts: tuple[int, Optional[int]]):
+        view = memoryview(buffer)
+        self._parts = deque(view[start:end] for start, end in parts)
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._parts and size:
+            part = self._parts[0]
+            end = len(part) if size < 0 else min(size, len(part))
+            chunks.append(part[:end].tobytes())
+
+            if end == len(part):
+                self._parts.popleft()
+            else:
+                self._parts[0] = part[end:]
+
+            if size > 0:
+                size -= end
+
+        return b"".join(chunks)
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def _ebml_number(buffer, pos: int, marker: bool) -> tuple[Optional[int], int]:
+    """Read an EBML variable length number, return it and the position after it.
+
+    IDs keep their length `marker`, sizes don't. Unknown sizes are `None`.
+    """
+
+    first = buffer[pos]
+    length = 1
+    mask = 0x80
+    while not first & mask:
+        mask >>= 1
+        length += 1
+        if length > 8:
+            raise ValueError("Invalid EBML number.")
+
+    value = first if marker else first & (mask - 1)
+    unknown = not marker and value == mask - 1
+    for byte in buffer[pos + 1 : pos + length]:
+        value = value << 8 | byte
+        unknown = unknown and byte == 0xFF
+
+    if pos + length > len(buffer):
+        raise ValueError("Truncated EBML number.")
+
+    return None if unknown else value, pos + length
+
+
+def _ebml_element(buffer, pos: int) -> tuple[int, Optional[int], int]:
+    """Read the header of an EBML element, return its ID, size and data position."""
+
+    element, pos = _ebml_number(buffer, pos, True)
+    size, pos = _ebml_number(buffer, pos, False)
+    return element, size, pos
+
+
+def _ebml_sized(buffer, pos: int) -> tuple[int, int, int]:
+    """Read the header of an EBML element that must have a known size."""
+
+    element, size, pos = _ebml_element(buffer, pos)
+    if size is None:
+        raise ValueError("Unknown EBML element size.")
+
+    return element, size, pos
+
+
+def _cluster_size(buffer, pos: int) -> int:
+    """Return the size of a cluster of unknown size starting at `pos`.
+
+    It ends at the next element of the segment, or at the end of the file.
+    """
+
+    end = pos
+    while end < len(buffer):
+        element, size, child = _ebml_element(buffer, end)
+        if element in EBML_TOP_LEVEL:
+            break
+
+        if size is None:
+            raise ValueError("Unknown EBML element size.")
+
+        end = child + size
+
+    return end - pos
+
+
+class SeekIndex:
+    """Index of the clusters of a WebM file by time.
+
+    A song can start at any cluster by feeding ffmpeg the header
+    of the file followed by the audio from that cluster, so seeking
+    doesn't read or decode anything before it. Clusters are a few
+    seconds long, ffmpeg skips the rest of the way. Clusters written
+    while streaming, with an unknown size, are indexed as well.
+    """
+
+    def __init__(self, header: int, times: list[float], offsets: list[int]):
+        self.header = header
+        self.times = times
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, buffer) -> Optional["SeekIndex"]:
+        """Index the clusters of a WebM file, `None` if it can't be indexed."""
+
+        try:
+            return cls._parse(memoryview(buffer))
+        except (ValueError, IndexError):
+            return None
+
+    @classmethod
+    def _parse(cls, buffer) -> Optional["SeekIndex"]:
+        # Skip the EBML header, everything is in the segment after it
+        _, size, pos = _ebml_sized(buffer, 0)
+        element, _, pos = _ebml_element(buffer, pos + size)
+        if element != EBML_SEGMENT:
+            return None
+
+        scale = 1_000_000
+        times, offsets = [], []
+        while pos < len(buffer):
+            start = pos
+            element, size, pos = _ebml_element(buffer, pos)
+            if size is None:
+                if element != EBML_CLUSTER:
+                    return None
+
+                size = _cluster_size(buffer, pos)
+
+            if element == EBML_INFO:
+                child = pos
+                while child < pos + size:
+                    child_id, child_size, child = _ebml_sized(buffer, child)
+                    if child_id == EBML_TIMECODE_SCALE:
+                        scale = int.from_bytes(buffer[child : child + child_size])
+                    child += child_size
+
+            elif element == EBML_CLUSTER:
+                child_id, child_size, child = _ebml_sized(buffer, pos)
+                if child_id == EBML_CLUSTER_TIMECODE:
+                    timecode = int.from_bytes(buffer[child : child + child_size])
+                    times.append(timecode * scale / 1e9)
+                    offsets.append(start)
+
+            pos += size
+
+        if not offsets:
+            return None
+
+        return cls(offsets[0], times, offsets)
+
+    def locate(self, position: float) -> tuple[int, float]:
+        """Return the offset and time of the last cluster starting before `position`."""
+
+        index = max(0, bisect_right(self.times, position) - 1)
+        return self.offsets[index], self.times[index]
+
+    def reader(self, buffer, position: float) -> tuple[SplicedReader, float]:
+        """Return a reader of the file from the cluster before `position`.
+
+        Also returns the seconds left from the cluster to `position`.
+        """
+
+        offset, start = self.locate(position)
+        reader = SplicedReader(buffer, (0, self.header), (offset, None))
+        return reader, max(0.0, position - start)
+
+
+class TrackedSource(discord.AudioSource):
+    """Wrap a source to keep track of the position in the song.
+
+    `start` is the position of the first frame in the song.
+    If set, `callback` is called from the player thread with the
+    seconds from `started` to the first frame, and the time of the
+    first frame from `time.perf_counter`.
+    """
+
+    def __init__(
+        self,
+        original: discord.AudioSource,
+        start: float = 0.0,
+        started: Optional[float] = None,
+        callback: Optional[Callable[[float, float], None]] = None,
+    ):
+        self.original = original
+        self.start = start
+        self.frames = 0
+        self._started = started
+        self._callback = callback
+
+    @property
+    def position(self) -> float:
+        """Return the position in the song, in seconds."""
+
+        return self.start + self.frames * FRAME_LENGTH
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data:
+            self.frames += 1
+
+        callback, self._callback = self._callback, None
+        if callback is not None:
+            now = time.perf_counter()
+            callback(now - self._started, now)
+
+        return data
+
+    def prime(self) -> bool:
+        """Decode the first frame ahead of time, see `Decoder.prime`."""
+
+        return self.original.prime()
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        self.original.cleanup()
+
+
+class GaplessSource(discord.AudioSource):
+    """Play the songs of a guild back to back from a single source.
+
+    `on_near_end` is called once from the player thread with this
+    source when the current song has `lead` seconds left, to start the decoder of
+    the next song with `queue_next`. When the current song ends,
+    `on_switch` is called with the next song and the volume its
+    decoder was started with. If it accepts the song, its primed
+    first frame is returned by the same read, without any gap.
+    Otherwise the source ends and the player moves on as usual.
+
+    With `crossfade` seconds, the end of a PCM song is mixed
+    with the start of the next one. Opus frames can't be mixed.
+    """
+
+    def __init__(
+        self,
+        original: TrackedSource,
+        song,
+        lead: float = 0.0,
+        crossfade: float = 0.0,
+        on_near_end: Optional[Callable[["GaplessSource"], None]] = None,
+        on_switch: Optional[Callable[[object, int], bool]] = None,
+    ):
+        self.original = original
+        self.song = song
+        self.lead = max(lead, crossfade)
+        self.crossfade = crossfade
+        self.on_near_end = on_near_end
+        self.on_switch = on_switch
+
+        self._lock = threading.Lock()
+        self._upcoming: Optional[tuple[object, TrackedSource, int]] = None
+        self._warned = False
+        self._finished = False
+
+    def queue_next(self, song, source: TrackedSource, volume: int) -> None:
+        """Set the primed source of the next song, from any thread."""
+
+        with self._lock:
+            if not self._finished and self._upcoming is None:
+                self._upcoming, source = (song, source, volume), None
+
+        # The song ended before the next one was ready
+        if source is not None:
+            source.cleanup()
+
+    def remaining(self) -> float:
+        """Return the seconds left in the current song."""
+
+        return (self.song.duration or 0) - self.original.position
+
+    def read(self) -> bytes:
+        data = self.original.read()
+
+        if not data:
+            return self._switch()
+
+        remaining = self.remaining()
+        if not self._warned and self.song.duration and remaining <= self.lead:
+            self._warned = True
+            if self.on_near_end is not None:
+                self.on_near_end(self)
+
+        if self.crossfade and remaining <= self.crossfade:
+            return self._mix(data, remaining)
+
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self._finished = True
+            upcoming, self._upcoming = self._upcoming, None
+
+        self.original.cleanup()
+        if upcoming is not None:
+            upcoming[1].cleanup()
+
+    def _switch(self) -> bytes:
+        """Move on to the next song once the current one ended."""
+
+        with self._lock:
+            upcoming, self._upcoming = self._upcoming, None
+            if upcoming is None:
+                self._finished = True
+
+        if upcoming is None:
+            return b""
+
+        song, source, volume = upcoming
+        if self.on_switch is None or not self.on_switch(song, volume):
+            with self._lock:
+                self._finished = True
+            source.cleanup()
+            return b""
+
+        # Reaping the old ffmpeg would delay the first frame of the next song
+        previous, self.original = self.original, source
+        threading.Thread(target=previous.cleanup, daemon=True).start()
+
+        self.song = song
+        self._warned = False
+        return source.read()
+
+    def _mix(self, data: bytes, remaining: float) -> bytes:
+        """Fade the current frame out into the next song."""
+
+        with self._lock:
+            upcoming = self._upcoming
+
+        if np is None or upcoming is None or self.is_opus():
+            return data
+
+        source = upcoming[1]
+        if source.is_opus():
+            return data
+
+        # The next song is played from here, its frames are consumed
+        incoming = source.read()
+
+        current = np.frombuffer(data, dtype=np.int16)
+        mixed = np.zeros(len(current), dtype=np.float32)
+        if incoming:
+            samples = np.frombuffer(incoming, dtype=np.int16)[: len(current)]
+            mixed[: len(samples)] = samples
+
+        # One gain per stereo sample, from the start of the frame to its end
+        start = 1 - remaining / self.crossfade
+        end = min(1.0, start + FRAME_LENGTH / self.crossfade)
+        fade = np.linspace(max(0.0, start), end, len(current) // 2, False)
+        fade = np.repeat(fade.astype(np.float32), 2)
+
+        mixed = current * (1 - fade) + mixed * fade
+        np.clip(mixed, -32768, 32767, out=mixed)
+        return mixed.astype(np.int16).tobytes()
+
+
+class RampedVolume(discord.PCMVolumeTransformer):
+    """Volume control applied to whole PCM frames with NumPy.
+
+    When the volume changes, the next frame ramps from the old
+    volume to the new one, so the change doesn't click.
+    """
+
+    def __init__(self, original: discord.AudioSource, volume: float = 1.0):
+        super().__init__(original, volume)
+        self._current = self._volume
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        target = self._volume
+
+        if not data or (target == 1.0 and self._current == 1.0):
+            return data
+
+        samples = np.frombuffer(data, dtype=np.int16)
+        if self._current == target:
+            scaled = samples * np.float32(target)
+        else:
+            # One gain per stereo sample, from the old volume to the new one
+            ramp = np.linspace(self._current, target, len(samples) // 2, False)
+            scaled = samples * np.repeat(ramp.astype(np.float32), 2)
+
+        # Only a volume above 100% can overflow the samples
+        if max(self._current, target) > 1.0:
+            np.clip(scaled, -32768, 32767, out=scaled)
+
+        self._current = target
+        return scaled.astype(np.int16).tobytes()
+
+
+def measure_loudness(data: bytes, timeout: float = 60) -> Optional[float]:
+    """Return the integrated loudness of some audio in LUFS, decoding it with ffmpeg."""
+
+    try:
+        process = subprocess.run(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-nostats",
+                "-i",
+                "pipe:0",
+                "-filter:a",
+                "ebur128=framelog=quiet",
+                "-f",
+                "null",
+                "-",
+            ],
+            input=data,
+            capture_output=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        log("Can't measure loudness.", e, level=logging.WARNING)
+        return None
+
+    match = LOUDNESS_PATTERN.search(process.stderr)
+    if match is None:
+        return None
+
+    return float(match.group(1))
+
+
+def normalization_gain(
+    loudness: Optional[float],
+    target: Optional[float],
+    tolerance: float = 0.0,
+) -> float:
+    """Return the gain in dB that brings a song to the target loudness.
+
+    Songs within `tolerance` dB of the target are left as they are.
+    """
+
+    if loudness is None or target is None:
+        return 0.0
+
+    gain = max(-MAX_GAIN, min(MAX_GAIN, target - loudness))
+    if abs(gain) <= tolerance:
+        return 0.0
+
+    return gain
+
+
+def playback_position(source: Optional[discord.AudioSource]) -> Optional[float]:
+    """Return the position in the song of a source made by `create_decoder`."""
+
+    while source is not None and not isinstance(source, TrackedSource):
+        source = getattr(source, "original", None)
+
+    return source.position if source is not None else None
+
+
+def create_decoder(
+    fp: IO[bytes],
+    volume: int,
+    codec: Optional[str] = None,
+    passthrough: bool = True,
+    on_first_frame: Optional[Callable[[float, float], None]] = None,
+    gain: float = 0.0,
+    position: float = 0.0,
+    skip: float = 0.0,
+    name: str = "",
+    timeout: float = DECODER_TIMEOUT,
+) -> TrackedSource:
+    """Start the ffmpeg that decodes a song for Discord.
+
+    With `passthrough`, opus songs at full volume and without
+    a normalization `gain` in dB are remuxed into opus frames without
+    being decoded at all. Any other volume and gain is applied by
+    ffmpeg while it encodes to opus, so the audio never goes through
+    python as PCM. Without `passthrough`, ffmpeg only applies
+    the gain and decodes to PCM, see `with_volume` for the volume.
+
+    `position` is the time in the song `fp` starts at, after
+    ffmpeg skips the first `skip` seconds of it.
+    """
+
+    started = time.perf_counter()
+    scale = 10 ** (gain / 20)
+    before_options = f"-ss {skip:.3f}" if skip else None
+    stderr = FFmpegLog(name)
+
+    if not passthrough:
+        options = f"-filter:a volume={scale:.4f}" if gain else None
+        audio = discord.FFmpegPCMAudio(
+            fp,
+            pipe=True,
+            before_options=before_options,
+            options=options,
+            stderr=stderr,
+        )
+    elif codec == "opus" and volume == 100 and not gain:
+        audio = discord.FFmpegOpusAudio(
+            fp,
+            pipe=True,
+            codec="copy",
+            before_options=before_options,
+            stderr=stderr,
+        )
+    else:
+        options = None
+        if volume != 100 or gain:
+            options = f"-filter:a volume={volume / 100 * scale:.4f}"
+
+        audio = discord.FFmpegOpusAudio(
+            fp,
+            pipe=True,
+            before_options=before_options,
+            options=options,
+            stderr=stderr,
+        )
+
+    decoder = Decoder(audio, stderr, timeout)
+    return TrackedSource(decoder, position, started, on_first_frame)
+
+
+def with_volume(
+    source: discord.AudioSource,
+    volume: int,
+    passthrough: bool = True,
+) -> discord.AudioSource:
+    """Apply the volume to PCM sources, opus sources have it already."""
+
+    if passthrough:
+        return source
+
+    transformer = RampedVolume if np is not None else discord.PCMVolumeTransformer
+    return transformer(source, volume / 100)
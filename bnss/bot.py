@@ -1,15 +1,99 @@
+from dataclasses import dataclass
+
 import discord
 from discord import Activity, ActivityType
 from discord.ext import commands
 
-from bnss.settings import get_settings
+from bnss.settings import Settings, get_settings
+
+
+@dataclass
+class CacheProfile:
+    """What the bot receives from the gateway and keeps in memory."""
+
+    intents: discord.Intents
+    member_cache_flags: discord.MemberCacheFlags
+    chunk_guilds_at_startup: bool
+    # Messages kept in the cache, none if 0
+    max_messages: int
+
+
+def music_profile() -> CacheProfile:
+    """Cache only guilds, voice states and command messages.
+
+    Members are never requested, they come with the messages
+    that invoke commands and with voice states.
+    """
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.voice_states = True
+    intents.guild_messages = True
+    intents.message_content = True
+
+    # Only the members in a voice channel are kept
+    members = discord.MemberCacheFlags.none()
+    members.voice = True
+
+    return CacheProfile(intents, members, False, 0)
+
+
+def full_profile() -> CacheProfile:
+    """Cache every member, presence and message, like a general purpose bot."""
+
+    return CacheProfile(
+        discord.Intents.all(),
+        discord.MemberCacheFlags.all(),
+        True,
+        1000,
+    )
+
+
+CACHE_PROFILES = {
+    "music": music_profile,
+    "full": full_profile,
+}
+
+
+def cache_profile(settings: Settings) -> CacheProfile:
+    """Return the cache profile of the settings, with their overrides."""
+
+    profile = CACHE_PROFILES[settings.cache_profile]()
+
+    # Members can only be cached and chunked with the intents that send them
+    if settings.intents is not None:
+        profile.intents = discord.Intents(**dict.fromkeys(settings.intents, True))
+        profile.member_cache_flags = discord.MemberCacheFlags.from_intents(
+            profile.intents
+        )
+        profile.chunk_guilds_at_startup &= profile.intents.members
+
+    if settings.member_cache_flags is not None:
+        profile.member_cache_flags = discord.MemberCacheFlags(
+            **dict.fromkeys(settings.member_cache_flags, True)
+        )
+
+    if settings.chunk_guilds_at_startup is not None:
+        profile.chunk_guilds_at_startup = settings.chunk_guilds_at_startup
+
+    if settings.max_messages is not None:
+        profile.max_messages = settings.max_messages
+
+    return profile
+
+
+class BNSSBot(commands.AutoShardedBot):
+    """The bot, running all the shards of `shard_ids`.
 
+    If no shards are given, Discord decides how many shards
+    the bot needs and they all run in this process.
+    """
 
-class BNSSBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         self.settings = get_settings()
         self._prefix = self.settings.prefix
-        self._intents = discord.Intents.all()
+        self._cache = cache_profile(self.settings)
+        self._intents = self._cache.intents
         self._activity = Activity(
             type=ActivityType.listening,
             name=f"{self._prefix}help",
@@ -19,6 +103,9 @@ class BNSSBot(commands.Bot):
             *args,
             command_prefix=self._prefix,
             intents=self._intents,
+            member_cache_flags=self._cache.member_cache_flags,
+            chunk_guilds_at_startup=self._cache.chunk_guilds_at_startup,
+            max_messages=self._cache.max_messages or None,
             activity=self._activity,
             **kwargs,
         )
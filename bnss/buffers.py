@@ -0,0 +1,132 @@
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+from bnss.helpers import Song
+from bnss.logger import log
+
+
+class _Entry:
+    """Accounting of the audio of a registered song."""
+
+    __slots__ = ("ref", "size", "path")
+
+    def __init__(self, ref: weakref.ref, size: int):
+        self.ref = ref
+        self.size = size
+        self.path: Optional[str] = None
+
+
+class BufferManager:
+    """Keep the audio that songs hold in memory under a budget.
+
+    Songs are registered once their download is finished. When
+    the audio of all the songs goes over `max_bytes`, the least
+    recently played ones are written to temporary files, and
+    are read back from disk the next time they are played.
+    Songs are forgotten, and their files removed, once nothing
+    references them anymore.
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+
+        # Songs can be collected while the lock is held
+        self._lock = threading.RLock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def add(self, song: Song) -> None:
+        """Start tracking the audio of a song."""
+
+        with self._lock:
+            key = id(song)
+            if key in self._entries or song.data is None:
+                return
+
+            ref = weakref.ref(song, lambda _, key=key: self._release(key))
+            entry = _Entry(ref, song.size)
+            self._entries[key] = entry
+            self.memory_bytes += entry.size
+
+            self._enforce()
+
+    def touch(self, song: Song) -> None:
+        """Mark a song as recently played."""
+
+        with self._lock:
+            if id(song) in self._entries:
+                self._entries.move_to_end(id(song))
+
+    def _enforce(self) -> None:
+        """Spill the coldest songs to disk until the budget is met."""
+
+        for key, entry in list(self._entries.items()):
+            if self.memory_bytes <= self.max_bytes:
+                return
+
+            song = entry.ref()
+            if song is None or entry.path is not None or not entry.size:
+                continue
+
+            try:
+                self._spill(song, entry)
+            except OSError as e:
+                log("Can't spill song to disk.", e)
+                return
+
+    def _spill(self, song: Song, entry: _Entry) -> None:
+        """Move the audio of a song from memory to a temporary file."""
+
+        fd, path = tempfile.mkstemp(
+            prefix="bnss-",
+            suffix=".audio",
+            dir=self.directory,
+        )
+        with os.fdopen(fd, "wb") as file:
+            file.write(song.data.getbuffer())
+
+        # Set the path first, readers check the data before the path
+        song.path = path
+        song.data = None
+
+        entry.path = path
+        self.memory_bytes -= entry.size
+        self.spilled_bytes += entry.size
+
+    def _release(self, key: int) -> None:
+        """Forget a song that was garbage collected."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+
+            if entry.path is None:
+                self.memory_bytes -= entry.size
+                return
+
+            self.spilled_bytes -= entry.size
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """Return the current usage of the buffers."""
+
+        return {
+            "songs": len(self._entries),
+            "memory_bytes": self.memory_bytes,
+            "spilled_bytes": self.spilled_bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+from bnss.audio import MappedAudio
+from bnss.helpers import write_atomic
+
+
+class AudioCache:
+    """On-disk cache of downloaded songs, keyed by YouTube video ID.
+
+    Every song is stored as an audio file and a small JSON file
+    with the metadata needed to rebuild the `Song`.
+    When the cache grows past `max_bytes`, the least recently
+    used songs are removed first.
+    """
+
+    AUDIO_SUFFIX = ".audio"
+    INFO_SUFFIX = ".json"
+
+    def __init__(self, path: str | Path, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Index the songs already on disk, oldest access first."""
+
+        # Leftovers from writes that were interrupted
+        for tmp in self.path.glob("*.tmp"):
+            tmp.unlink(missing_ok=True)
+
+        files = []
+        for audio in self.path.glob(f"*{self.AUDIO_SUFFIX}"):
+            stat = audio.stat()
+            files.append((stat.st_mtime, audio.stem, stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.size += size
+
+        with self._lock:
+            self._evict()
+
+    def _audio_path(self, key: str) -> Path:
+        return self.path / f"{key}{self.AUDIO_SUFFIX}"
+
+    def _info_path(self, key: str) -> Path:
+        return self.path / f"{key}{self.INFO_SUFFIX}"
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def info(self, key: str) -> Optional[dict]:
+        """Return only the metadata of a cached song."""
+
+        if key not in self._entries:
+            return None
+
+        try:
+            return json.loads(self._info_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def map(self, key: str) -> Optional[MappedAudio]:
+        """Return a shared memory map of the audio of a cached song.
+
+        The mapping stays valid even if the song is evicted later.
+        """
+
+        with self._lock:
+            audio = self._map(key)
+            if audio is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        return audio
+
+    def _map(self, key: str) -> Optional[MappedAudio]:
+        """Map a song and mark it as recently used."""
+
+        if key not in self._entries:
+            return None
+
+        try:
+            audio = MappedAudio.open(self._audio_path(key))
+        except (OSError, ValueError):
+            self._remove(key)
+            return None
+
+        # Mark the song as recently used, on disk too
+        # so the order survives restarts
+        self._entries.move_to_end(key)
+        os.utime(self._audio_path(key))
+
+        return audio
+
+    def store(self, key: str, info: dict, data: bytes) -> Optional[MappedAudio]:
+        """Save a song in the cache, evicting old songs if needed.
+
+        Returns a shared memory map of the stored audio.
+        """
+
+        size = len(data)
+        if not size or size > self.max_bytes:
+            return None
+
+        with self._lock:
+            write_atomic(self._info_path(key), json.dumps(info).encode())
+            write_atomic(self._audio_path(key), data)
+
+            self.size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+            return self._map(key)
+
+    def _evict(self) -> None:
+        """Remove least recently used songs until the cache fits its budget."""
+
+        while self.size > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        """Remove a song from the index and the disk."""
+
+        self.size -= self._entries.pop(key, 0)
+        self._audio_path(key).unlink(missing_ok=True)
+        self._info_path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """Return the cache counters."""
+
+        return {
+            "songs": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class TTLCache:
+    """Thread safe in-memory cache whose entries expire after `ttl` seconds.
+
+    When the cache holds `max_entries`, the least recently
+    used entry is dropped to make room for a new one.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the value of a key if it hasn't expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value for `ttl` seconds."""
+
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
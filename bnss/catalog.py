@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    uploader TEXT NOT NULL DEFAULT '',
+    duration INTEGER NOT NULL DEFAULT 0,
+    thumbnail TEXT NOT NULL DEFAULT '',
+    acodec TEXT NOT NULL DEFAULT '',
+    plays INTEGER NOT NULL DEFAULT 0,
+    last_played REAL NOT NULL DEFAULT 0
+);
+"""
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search
+USING fts5(video_id UNINDEXED, title, uploader);
+"""
+
+
+class Catalog:
+    """On-disk catalog of the songs that were played, with title search.
+
+    Every played song is stored with its metadata and play count
+    in an SQLite database, so text queries can be answered without
+    searching Youtube. Titles and uploaders are indexed for prefix
+    search with FTS5, or scanned with LIKE if it isn't available.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+        try:
+            self._db.executescript(SEARCH_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def record(self, info: dict) -> None:
+        """Add a played song to the catalog, or count another play of it."""
+
+        row = (
+            info["id"],
+            info.get("title") or "",
+            info.get("uploader") or "",
+            info.get("duration") or 0,
+            info.get("thumbnail") or "",
+            info.get("acodec") or "",
+            time.time(),
+        )
+
+        with self._lock, self._db:
+            known = self._db.execute(
+                "SELECT 1 FROM tracks WHERE video_id = ?", (row[0],)
+            ).fetchone()
+
+            self._db.execute(
+                """
+                INSERT INTO tracks
+                (video_id, title, uploader, duration, thumbnail, acodec, plays, last_played)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (video_id) DO UPDATE SET
+                    plays = plays + 1,
+                    last_played = excluded.last_played,
+                    acodec = CASE WHEN excluded.acodec != ''
+                        THEN excluded.acodec ELSE acodec END
+                """,
+                row,
+            )
+
+            if self.fts and not known:
+                self._db.execute(
+                    "INSERT INTO search (video_id, title, uploader) VALUES (?, ?, ?)",
+                    row[:3],
+                )
+
+    def find(self, query: str) -> Optional[dict]:
+        """Return the info of the most played song matching every word of `query`.
+
+        The info has the same fields as `Song._to_info`.
+        """
+
+        words = query.split()
+        if not words:
+            return None
+
+        if self.fts:
+            # Quote every word so it can't be read as FTS syntax
+            match = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+            sql = """
+                SELECT tracks.* FROM search
+                JOIN tracks ON tracks.video_id = search.video_id
+                WHERE search MATCH ?
+                ORDER BY tracks.plays DESC, search.rank
+                LIMIT 1
+            """
+            params = (match,)
+        else:
+            where = " AND ".join(["(title || ' ' || uploader) LIKE ?"] * len(words))
+            sql = f"SELECT * FROM tracks WHERE {where} ORDER BY plays DESC LIMIT 1"
+            params = tuple(f"%{word}%" for word in words)
+
+        with self._lock:
+            try:
+                row = self._db.execute(sql, params).fetchone()
+            except sqlite3.OperationalError:
+                return None
+
+        if row is None:
+            return None
+
+        return {
+            "id": row["video_id"],
+            "title": row["title"],
+            "webpage_url": f"https://www.youtube.com/watch?v={row['video_id']}",
+            "duration": row["duration"],
+            "thumbnail": row["thumbnail"],
+            "acodec": row["acodec"],
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
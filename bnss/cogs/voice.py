@@ -1,19 +1,66 @@
+import asyncio
+import contextvars
+import copy
+import functools
 import logging
-import queue
-import subprocess
-from collections import defaultdict, namedtuple
-from contextlib import redirect_stdout
-from io import BytesIO
-from typing import Optional
+import math
+import threading
+import time
+from concurrent.futures import Future
+from itertools import islice
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import discord
 from discord import VoiceChannel, VoiceClient
 from discord.ext import commands, tasks
-from yt_dlp import YoutubeDL
 
+from bnss import metrics
+from bnss.admission import Bandwidth, LimitedStream, SongRejected
+from bnss.audio import (
+    DownloadCancelled,
+    GaplessSource,
+    StreamBuffer,
+    TrackedSource,
+    create_decoder,
+    measure_loudness,
+    normalization_gain,
+    playback_position,
+    with_volume,
+)
 from bnss.bot import BNSSBot
-from bnss.helpers import Song, VoiceSettings
-from bnss.logger import log
+from bnss.buffers import BufferManager
+from bnss.cache import AudioCache, TTLCache
+from bnss.catalog import Catalog
+from bnss.flights import Flight, Flights, SingleFlight
+from bnss.helpers import (
+    Song,
+    SongError,
+    capture_stdout,
+    format_timestamp,
+    is_playlist,
+    parse_timestamp,
+    video_id,
+)
+from bnss.idle import IdleTimers
+from bnss.logger import bind, log
+from bnss.prefetch import Prefetcher
+from bnss.scheduler import DownloadScheduler
+from bnss.snapshots import ResumedContext, SnapshotStore
+from bnss.state import GuildStates
+from bnss.workers import WorkerPool
+
+# yt-dlp takes a while to import, it's loaded when it's first needed
+if TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
+
+# Playlist songs are added to the queue in batches of this size
+PLAYLIST_BATCH = 20
+
+# Number of songs shown by the queue command
+QUEUE_PAGE_SIZE = 10
+
+# Only Youtube is played, so only its extractors are loaded
+YOUTUBE_EXTRACTORS = ["youtube", "youtube:tab", "youtube:search"]
 
 
 class VoiceCog(commands.Cog):
@@ -32,138 +79,1027 @@ class VoiceCog(commands.Cog):
         - volume ✔️
         - playing ✔️
         - replay ✔️
+        - seek ✔️
     """
 
     def __init__(self, bot: BNSSBot):
         self.bot = bot
-        self.default_settings = VoiceSettings()
-        self.guild_voice = defaultdict(lambda: VoiceSettings)
-        self.__lock = False
-        self.__next_download = queue.Queue()
+        self.guild_voice = GuildStates(
+            self.bot.settings.queue_max_size,
+            self.bot.settings.guild_idle_ttl,
+        )
+        self.scheduler = DownloadScheduler(self.bot.settings.max_downloads)
+        self.prefetcher = Prefetcher(
+            self.scheduler,
+            self.bot.settings.prefetch_depth,
+            self.bot.settings.prefetch_max_bytes,
+        )
+
+        self.buffers = BufferManager(
+            self.bot.settings.audio_max_bytes,
+            self.bot.settings.spill_dir,
+        )
+
+        self.cache = None
+        if self.bot.settings.cache_max_bytes:
+            self.cache = AudioCache(
+                self.bot.settings.cache_dir,
+                self.bot.settings.cache_max_bytes,
+            )
+
+        self.catalog = None
+        if self.bot.settings.catalog_path:
+            self.catalog = Catalog(self.bot.settings.catalog_path)
+
+        self.snapshots = None
+        if self.bot.settings.snapshot_dir:
+            self.snapshots = SnapshotStore(self.bot.settings.snapshot_dir)
+
+        # Songs requested by several guilds at once are extracted
+        # and downloaded once for all of them
+        self.extractions = SingleFlight()
+        self.flights = Flights()
+
+        self.bandwidth = Bandwidth(
+            self.bot.settings.download_rate,
+            self.bot.settings.guild_download_rate,
+            self.bot.settings.download_burst,
+        )
 
-        self.DownloadArgs = namedtuple("DownloadArgs", ("ctx", "voice", "query"))
+        self.info_cache = TTLCache(
+            self.bot.settings.info_cache_size,
+            self.bot.settings.info_cache_ttl,
+        )
 
+        # yt-dlp instances aren't thread safe,
+        # so every download thread keeps its own
+        self._ytdlp = threading.local()
         self.ytdl_opts = {
-            "format": "bestaudio/best",
+            "format": "bestaudio[acodec=opus]/bestaudio/best",
             "outtmpl": "-",
             "logtostderr": True,
             "quiet": True,
             "no_warnings": True,
+            "playlistend": self.bot.settings.playlist_max_size,
+            "allowed_extractors": YOUTUBE_EXTRACTORS,
         }
 
-        self.disconnect_task.start()
-        self.download_task.start()
+        # Playlists being added to the queue, set to stop adding them
+        self._playlists: dict[int, threading.Event] = {}
+
+        # Run yt-dlp in worker processes, so it doesn't hold the GIL
+        self.workers = None
+        if self.bot.settings.ytdlp_processes:
+            # Workers download to a file before the bot copies it,
+            # so they have to be throttled by yt-dlp itself
+            worker_opts = self.ytdl_opts
+            if self.bot.settings.guild_download_rate:
+                worker_opts = {
+                    **self.ytdl_opts,
+                    "ratelimit": self.bot.settings.guild_download_rate,
+                }
+
+            self.workers = WorkerPool(
+                self.bot.settings.ytdlp_processes,
+                self.bot.settings.ytdlp_timeout,
+                worker_opts,
+                self.bot.settings.spill_dir,
+            )
+
+        self.idle: Optional[IdleTimers] = None
+        self.evict_task.start()
+        self.warm_up_task.start()
+
+        if self.snapshots:
+            self.snapshot_task.change_interval(
+                seconds=self.bot.settings.snapshot_interval
+            )
+            self.snapshot_task.start()
+            self.resume_task.start()
+
+        metrics.QUEUE_DEPTH.callback = lambda: [
+            ({"guild": guild}, len(self.guild_voice.get(guild).queue))
+            for guild in self.guild_voice
+        ]
+        metrics.VOICE_CLIENTS.callback = lambda: len(self.bot.voice_clients)
+        metrics.BUFFERED_AUDIO_BYTES.callback = lambda: [
+            ({"state": "memory"}, self.buffers.memory_bytes),
+            ({"state": "spilled"}, self.buffers.spilled_bytes),
+        ]
+        metrics.EXECUTOR_BACKLOG.callback = lambda: self.scheduler.backlog
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        """Log the messages of a command with its guild and request."""
+
+        bind(guild=ctx.guild.id if ctx.guild else None, request=ctx.message.id)
+
+    async def cog_load(self):
+        """Start the download workers and the idle timers."""
+
+        self.scheduler.start()
+        self.idle = IdleTimers(
+            asyncio.get_running_loop(),
+            self.bot.settings.idle_disconnect_grace,
+            self.disconnect_idle,
+        )
 
-    @tasks.loop(seconds=1)
-    async def download_task(self):
-        """Get the next query from the download queue and download it."""
+    async def cog_unload(self):
+        """Stop the download workers and drop pending downloads."""
 
-        if self.__next_download.empty():
-            return
+        self.idle.clear()
+        self.evict_task.cancel()
+        self.warm_up_task.cancel()
+        await self.scheduler.stop()
 
-        song = self.__next_download.get()
-        loop = self.bot.loop
+        # Save the queues one last time before the bot stops
+        if self.snapshots:
+            self.snapshot_task.cancel()
+            self.resume_task.cancel()
+            self.snapshots.save(self.snapshot())
 
-        self.__lock = True
-        await loop.run_in_executor(
-            None,
-            self.queue_song,
-            song.ctx,
-            song.voice,
-            song.query,
-        )
-        self.__lock = False
+        if self.workers:
+            self.workers.close()
+
+        if self.catalog:
+            self.catalog.close()
+
+    @tasks.loop(minutes=1)
+    async def evict_task(self):
+        """Drop the player settings and audio of idle guilds."""
 
-        log("Downloaded song.", song.query)
+        for guild_id in self.guild_voice.idle():
+            guild = self.bot.get_guild(guild_id)
+            voice = guild.voice_client if guild else None
 
-    @download_task.before_loop
-    async def before_download_task(self):
+            # A song playing for a long time isn't idle
+            if voice and (voice.is_playing() or voice.is_paused()):
+                self.guild_voice.get(guild_id).touch()
+                continue
+
+            self.guild_voice.pop(guild_id)
+            self.prefetcher.forget(guild_id)
+            self.bandwidth.forget(guild_id)
+            log("Evicted idle guild.", guild_id, level=logging.DEBUG)
+
+        log("Audio buffers.", self.buffers.stats(), level=logging.DEBUG)
+
+    @evict_task.before_loop
+    async def before_evict_task(self):
         """Wait for the bot to be ready."""
 
         await self.bot.wait_until_ready()
 
-    @tasks.loop(minutes=2)
-    async def disconnect_task(self):
-        """Check if the bot should be disconnected."""
+    @tasks.loop(count=1)
+    async def warm_up_task(self):
+        """Load yt-dlp once the bot is online, instead of on the first song."""
 
-        voices = self.bot.voice_clients
-        if not voices:
-            return
+        started = time.perf_counter()
+        await self.bot.loop.run_in_executor(self.scheduler.executor, self.warm_up)
+        log(f"Loaded yt-dlp in {time.perf_counter() - started:.3f}s.")
+
+    @warm_up_task.before_loop
+    async def before_warm_up_task(self):
+        """Wait for the bot to be ready."""
+
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=15)
+    async def snapshot_task(self):
+        """Save the queues that changed, to resume them after a restart."""
+
+        try:
+            written = await self.bot.loop.run_in_executor(
+                None, self.snapshots.save, self.snapshot()
+            )
+        except OSError as e:
+            return log("Could not save the queues.", e, level=logging.ERROR)
+
+        if written:
+            log("Saved queues.", written, level=logging.DEBUG)
 
-        for voice in voices:
-            if not voice.is_playing():
-                await voice.disconnect()
+    @snapshot_task.before_loop
+    async def before_snapshot_task(self):
+        """Wait for the bot to be ready."""
+
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(count=1)
+    async def resume_task(self):
+        """Rejoin the voice channels and play the queues saved before a restart."""
+
+        snapshots = await self.bot.loop.run_in_executor(None, self.snapshots.load)
+
+        # Other processes resume the guilds of their shards
+        for guild_id, snapshot in snapshots.items():
+            if not self.owns(guild_id):
+                continue
 
-    @disconnect_task.before_loop
-    async def before_disconnect_task(self):
+            try:
+                resumed = await self.resume_guild(guild_id, snapshot)
+            except Exception as e:
+                log("Could not resume guild.", guild_id, e, level=logging.WARNING)
+                self.release(guild_id)
+                resumed = False
+
+            if resumed:
+                self.snapshots.claim(guild_id, snapshot)
+            else:
+                self.snapshots.remove(guild_id)
+
+    @resume_task.before_loop
+    async def before_resume_task(self):
         """Wait for the bot to be ready."""
 
         await self.bot.wait_until_ready()
 
+    def owns(self, guild_id: int) -> bool:
+        """Check if a guild is on one of the shards of this process."""
+
+        if self.bot.shard_ids is None:
+            return True
+
+        return (guild_id >> 22) % self.bot.shard_count in self.bot.shard_ids
+
+    def snapshot(self) -> dict[int, dict]:
+        """Return the player state of every guild with a queue to resume."""
+
+        snapshots = {}
+        for guild_id in self.guild_voice:
+            settings = self.guild_voice.get(guild_id)
+            guild = self.bot.get_guild(guild_id)
+            voice = guild.voice_client if guild else None
+            if not voice or not settings.queue or settings.text_channel is None:
+                continue
+
+            # The source of the last song stays around while the next one buffers
+            position = None
+            if voice.is_playing() or voice.is_paused():
+                position = playback_position(voice.source)
+
+            last_song = settings.last_song
+            snapshots[guild_id] = {
+                "channel": voice.channel.id,
+                "text_channel": settings.text_channel,
+                "loop": settings.loop,
+                "volume": settings.volume,
+                "position": round(position or 0.0, 1),
+                "queue": [song._to_snapshot() for song in list(settings.queue)],
+                "last_song": last_song._to_snapshot() if last_song else None,
+            }
+
+        return snapshots
+
+    async def resume_guild(self, guild_id: int, snapshot: dict) -> bool:
+        """Rejoin the voice channel of a guild and play its saved queue.
+
+        Like any queue, only the next songs are downloaded,
+        and songs that are in the audio cache aren't downloaded again.
+        Returns whether the guild was resumed.
+        """
+
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or guild.voice_client:
+            return False
+
+        channel = guild.get_channel(snapshot["channel"])
+        text_channel = guild.get_channel(snapshot["text_channel"])
+        songs = [Song._from_snapshot(info) for info in snapshot["queue"]]
+        if not isinstance(channel, VoiceChannel) or text_channel is None or not songs:
+            return False
+
+        settings = self.guild_voice[guild_id]
+        settings.loop = snapshot["loop"]
+        settings.volume = snapshot["volume"]
+        settings.text_channel = text_channel.id
+        for song in songs:
+            settings.queue.put(song, limit=len(songs))
+
+        last_song = snapshot["last_song"]
+        settings.last_song = Song._from_snapshot(last_song) if last_song else None
+
+        ctx = ResumedContext(guild, text_channel)
+        voice = await channel.connect()
+        self.prefetch(ctx)
+        self.play_song(ctx, voice, settings.queue.peek(), position=snapshot["position"])
+
+        log("Resumed queue.", guild_id, len(songs))
+        return True
+
+    def warm_up(self) -> None:
+        """Import yt-dlp and load its extractors, or start a worker that does."""
+
+        if self.workers:
+            return self.workers.warm_up()
+
+        self.get_ytdlp()
+
+    async def disconnect_idle(self, guild_id: int):
+        """Leave the voice channel of a guild that stayed idle."""
+
+        guild = self.bot.get_guild(guild_id)
+        voice = guild.voice_client if guild else None
+        if not voice:
+            return
+
+        # Something started playing without cancelling the timer
+        if voice.is_playing():
+            return
+
+        await voice.disconnect()
+        self.release(guild_id)
+        log("Disconnected idle guild.", guild_id, level=logging.DEBUG)
+
+    def release(self, guild_id: int):
+        """Drop the queue of a guild and the audio held for it."""
+
+        self.idle.cancel(guild_id)
+        self.stop_playlist(guild_id)
+        self.prefetcher.forget(guild_id)
+
+        settings = self.guild_voice.get(guild_id)
+        if settings:
+            settings.queue.clear()
+            settings.loop = False
+            settings.last_song = None
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(
+        self,
+        member: discord.Member,
+        before: discord.VoiceState,
+        after: discord.VoiceState,
+    ):
+        """Release a guild when the bot leaves its voice channel."""
+
+        if member.id != self.bot.user.id:
+            return
+
+        if before.channel and not after.channel:
+            self.release(member.guild.id)
+
+    def get_ytdlp(self) -> "YoutubeDL":
+        """Return the yt-dlp instance of the current thread."""
+
+        ytdlp = getattr(self._ytdlp, "instance", None)
+        if ytdlp is None:
+            from yt_dlp import YoutubeDL
+
+            ytdlp = YoutubeDL(self.ytdl_opts)
+            self._ytdlp.instance = ytdlp
+
+        return ytdlp
+
+    def get_flat_ytdlp(self) -> "YoutubeDL":
+        """Return the yt-dlp instance of the current thread that lists playlists."""
+
+        ytdlp = getattr(self._ytdlp, "flat", None)
+        if ytdlp is None:
+            from yt_dlp import YoutubeDL
+
+            ytdlp = YoutubeDL({**self.ytdl_opts, "extract_flat": "in_playlist"})
+            self._ytdlp.flat = ytdlp
+
+        return ytdlp
+
+    def extract_info(self, query: str) -> dict:
+        """Extract the info of a song, using the cache if possible."""
+
+        key = video_id(query)
+        info = self.info_cache.get(key) if key else None
+        if info is not None:
+            return info
+
+        def extract() -> dict:
+            with metrics.EXTRACT_SECONDS.time():
+                if self.workers:
+                    info = self.workers.extract(query)
+                else:
+                    info = self.get_ytdlp().extract_info(query, download=False)
+
+            if key:
+                self.info_cache.set(key, info)
+
+            return info
+
+        return self.extractions.do(key or query, extract)
+
     def is_valid_song(self, info: dict) -> bool:
-        """Check if the filesize and duration of a song is OK,"""
+        """Check if the filesize and duration of a song is OK.
+
+        Either can be missing from the info, DASH formats often have
+        no filesize. The limits are checked again while the song
+        downloads, see `LimitedStream`.
+        """
+
+        max_duration = self.bot.settings.max_song_duration
+        max_bytes = self.bot.settings.max_song_bytes
 
         # Check if the song is too long
-        if info["duration"] > 600:
+        duration = info.get("duration")
+        if max_duration and duration and duration > max_duration:
+            metrics.REJECTED_SONGS.inc(reason="duration")
             return False
 
         # Check if the song is too large
-        if info["filesize"] > 20_000_000:
+        filesize = info.get("filesize") or info.get("filesize_approx")
+        if max_bytes and filesize and filesize > max_bytes:
+            metrics.REJECTED_SONGS.inc(reason="filesize")
             return False
 
         return True
 
-    def queue_song(self, ctx: commands.Context, voice: VoiceClient, query: str):
-        """Download a song and queue it."""
+    def resolve_song(self, query: str) -> Song:
+        """Find the song of a query without downloading it.
+
+        Raises `SongError` if the song can't be played.
+        """
+
+        # Answer text queries from the songs played before
+        search = not query.startswith("http")
+        if search and self.catalog:
+            info = self.catalog.find(query)
+            if info:
+                log("Found song in catalog.", info["webpage_url"])
+                self.catalog.record(info)
+                return Song._from_info(info)
+
+        # Skip yt-dlp entirely if the song is already cached
+        key = video_id(query)
+        if self.cache and key:
+            info = self.cache.info(key)
+            if info:
+                if self.catalog:
+                    self.catalog.record({**info, "id": key})
+                return Song._from_info(info)
+
+        if search:
+            info = self.search_song(query)
+        else:
+            info = self.extract_info(query)
+
+        # Check if the song is OK to download and play
+        if not self.is_valid_song(info):
+            log("Not a valid song.", level=logging.ERROR)
+            raise SongError("The song is too large or too long to download.")
+
+        if self.catalog:
+            self.catalog.record(info)
+
+        return Song._from_info(info)
+
+    def search_song(self, query: str) -> dict:
+        """Return the info of the first Youtube result for a query."""
+
+        with metrics.EXTRACT_SECONDS.time():
+            if self.workers:
+                info = self.workers.extract(f"ytsearch1:{query}")
+            else:
+                info = self.get_ytdlp().extract_info(
+                    f"ytsearch1:{query}", download=False
+                )
+
+        entries = info.get("entries") or []
+        if not entries:
+            raise SongError("No song found.")
+
+        # Keep the info for the download
+        info = entries[0]
+        self.info_cache.set(info["id"], info)
+        return info
+
+    def list_playlist(self, url: str) -> Iterator[Song]:
+        """List the songs of a playlist as placeholders.
+
+        Only the pages of the playlist are fetched, not the songs,
+        and they are fetched as the entries are iterated.
+        """
+
+        if self.workers:
+            info = self.workers.extract(url, flat=True)
+        else:
+            info = self.get_flat_ytdlp().extract_info(
+                url, download=False, process=False
+            )
+
+        entries = info.get("entries") or []
+        for entry in islice(entries, self.bot.settings.playlist_max_size):
+            # Private and deleted videos have no ID
+            if entry and entry.get("id"):
+                yield Song._from_entry(entry)
+
+    def ingest_playlist(
+        self,
+        ctx: commands.Context,
+        voice: VoiceClient,
+        url: str,
+        stop: threading.Event,
+    ):
+        """Add the songs of a playlist to the queue while they are listed.
+
+        Runs in a worker thread and returns the number of songs added.
+        Listing ends early once `stop` is set.
+        """
+
+        added = 0
+        batch = []
+        for song in self.list_playlist(url):
+            if stop.is_set():
+                break
+
+            # The duration is known, the size only once it's downloaded
+            max_duration = self.bot.settings.max_song_duration
+            if max_duration and song.duration > max_duration:
+                metrics.REJECTED_SONGS.inc(reason="duration")
+                continue
 
-        settings = self.guild_voice[ctx.guild]
+            song.requester = ctx.author.name
+            batch.append(song)
+            if len(batch) < PLAYLIST_BATCH:
+                continue
+
+            # Stop listing once the queue is full
+            count = self.queue_songs_threadsafe(ctx, voice, batch)
+            added += count
+            if count < len(batch):
+                break
+
+            batch = []
+        else:
+            if batch and not stop.is_set():
+                added += self.queue_songs_threadsafe(ctx, voice, batch)
+
+        return added
+
+    def stop_playlist(self, guild_id: int) -> None:
+        """Stop adding the playlist of a guild to its queue."""
+
+        stop = self._playlists.pop(guild_id, None)
+        if stop:
+            stop.set()
+
+    def queue_songs_threadsafe(
+        self,
+        ctx: commands.Context,
+        voice: VoiceClient,
+        songs: list[Song],
+    ) -> int:
+        """Queue songs from a worker thread and return how many fit."""
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.queue_songs(ctx, voice, songs),
+            self.bot.loop,
+        )
+        return future.result()
+
+    def download_song(self, ctx: commands.Context, song: Song) -> Optional[Future]:
+        """Download a song into its buffer.
+
+        The buffer can be played while it's written,
+        so playback can start before the download ends.
+        If another guild is already downloading the song, the song
+        reads the buffer of that download and a future for its end
+        is returned, so the download worker isn't held while it runs.
+        """
+
+        stream = song.buffer()
+
+        # Play cached songs straight from the cached file,
+        # shared with every other guild playing them
+        key = video_id(song.link)
+        if self.cache and key:
+            song.mapped = self.cache.map(key)
+            if song.mapped:
+                if not song.codec:
+                    song.codec = (self.cache.info(key) or {}).get("acodec", "")
+
+                song.seek_index()
+
+                log(
+                    "Loaded song from cache.",
+                    song.link,
+                    self.cache.stats(),
+                    guild=ctx.guild.id,
+                )
+                stream.close()
+                song.stream = None
+                return
 
         # https://github.com/yt-dlp/yt-dlp/issues/3298#issuecomment-1181754989
-        # Should be a valid way to download the song into BytesIO
-        # and then convert into a discord.FFmpegPCMAudio object
-        buffer = BytesIO()
-        with redirect_stdout(buffer), YoutubeDL(self.ytdl_opts) as ytdlp:
-            info = ytdlp.extract_info(query, download=False)
+        # Download the song into the buffer, reusing the extracted
+        # info so the page isn't fetched and parsed a second time.
+        # yt-dlp adds download fields to the info, so don't touch the cached one.
+        try:
+            info = copy.deepcopy(self.extract_info(song.link))
+
+            # Songs of playlists are only checked once they are extracted
+            if not song.codec:
+                if not self.is_valid_song(info):
+                    stream.close(abort=True)
+                    self.notify(
+                        ctx, f"**{song.name}** is too long or too large. Skipping it."
+                    )
+                    self.bot.loop.call_soon_threadsafe(self.drop_song, ctx, song)
+                    return
 
-            song = Song._from_info(info)
-            song.requester = ctx.author.name
+                song.codec = info.get("acodec", "")
+                if self.catalog:
+                    self.catalog.record(info)
+        except Exception as e:
+            stream.close(abort=True)
+            log(str(e), level=logging.ERROR, guild=ctx.guild.id)
+            self.notify(ctx, f"Can't download **{song.name}**. Skipping it.")
+            self.bot.loop.call_soon_threadsafe(self.drop_song, ctx, song)
+            return
 
-            # Check if the song is OK to download and play
-            if not self.is_valid_song(info):
-                log("Not a valid song.", level=logging.ERROR)
-                self._result = "The song is too large or too long to download."
-                return
+        # The first song with the video ID runs the download,
+        # the others read its buffer while it runs
+        flight, first = self.flights.join(key or song.link, stream)
+        if first:
+            self.fetch_song(ctx.guild.id, song, flight, info, key or song.link)
+            return self.finish_download(ctx, song, stream, flight.future)
+
+        # The song was cancelled before it could share the download
+        if not song.share_buffer(flight.stream):
+            flight.stream.cancel()
+            return
 
-            # Download the song into the buffer
+        stream = flight.stream
+        log("Sharing download.", song.link, level=logging.DEBUG, guild=ctx.guild.id)
+        done = Future()
+
+        def finish(download: Future):
             try:
-                ytdlp.download([query])
-            except Exception as e:
-                log(str(e), level=logging.ERROR)
-                self._result = "Can't download song. Please try another URL."
-                return
+                self.finish_download(ctx, song, stream, download)
+            finally:
+                done.set_result(None)
+
+        flight.future.add_done_callback(finish)
+        return done
+
+    def fetch_song(
+        self, guild: int, song: Song, flight: Flight, info: dict, key: str
+    ) -> None:
+        """Run the download of a flight, then land it with its result.
+
+        The download is done within the limits and the bandwidth
+        budget of `guild`. The result is the cached file, the buffer
+        of the flight and the loudness, shared by all the songs of the flight.
+        """
+
+        target = LimitedStream(
+            flight,
+            info,
+            guild,
+            self.bandwidth,
+            self.bot.settings.max_song_bytes,
+            self.bot.settings.max_song_duration,
+        )
+
+        try:
+            with metrics.DOWNLOAD_SECONDS.time():
+                if self.workers:
+                    self.workers.download(info, target)
+                else:
+                    with capture_stdout(target):
+                        self.get_ytdlp().process_ie_result(info, download=True)
+
+            flight.stream.close()
+            data = flight.stream.getbuffer()
+            metrics.DOWNLOAD_BYTES.observe(len(data))
+
+            # Measure the song once, the loudness is cached with it
+            if self.bot.settings.loudness_target is not None:
+                song.loudness = measure_loudness(data)
+
+            mapped = None
+            if self.cache and video_id(song.link):
+                mapped = self.cache.store(key, song._to_info(), data)
+        except Exception as e:
+            self.flights.land(key, flight, error=e)
+            return
+
+        self.flights.land(key, flight, (mapped, flight.stream, song.loudness))
+
+    def finish_download(
+        self,
+        ctx: commands.Context,
+        song: Song,
+        stream: StreamBuffer,
+        download: Future,
+    ) -> None:
+        """Keep the audio of a finished download, or tell why it failed."""
+
+        try:
+            mapped, data, loudness = download.result()
+
+            # The song was skipped while the download went on for the others
+            if song.stream is not stream:
+                raise DownloadCancelled()
+        except DownloadCancelled:
+            log("Download cancelled.", song.link, guild=ctx.guild.id)
+            return
+        except SongRejected as e:
+            stream.close(abort=True)
+            metrics.REJECTED_SONGS.inc(reason=e.reason)
+            log("Download aborted.", song.link, e, guild=ctx.guild.id)
+            self.notify(ctx, f"**{song.name}** is too long or too large. Skipping it.")
+            self.bot.loop.call_soon_threadsafe(self.drop_song, ctx, song)
+            return
+        except Exception as e:
+            stream.close(abort=True)
+            log(str(e), level=logging.ERROR, guild=ctx.guild.id)
+            self.notify(ctx, f"Can't download **{song.name}**. Skipping it.")
+            self.bot.loop.call_soon_threadsafe(self.drop_song, ctx, song)
+            return
+
+        log("Downloaded song.", song.link, guild=ctx.guild.id)
+
+        stream.close()
+        song.loudness = loudness
+        song.mapped = mapped
+
+        # Keep the song in memory only if it couldn't be cached,
+        # all the songs of the download share the same buffer
+        if mapped is None:
+            song.data = data
+
+        song.stream = None
+        song.seek_index()
+        self.buffers.add(song)
 
-        buffer.seek(0)
-        song.data = buffer
+    def prefetch(self, ctx: commands.Context) -> None:
+        """Download the next songs of the guild in the background."""
+
+        settings = self.guild_voice[ctx.guild.id]
+        self.prefetcher.update(
+            ctx.guild.id,
+            settings.queue,
+            functools.partial(self.download_song, ctx),
+        )
+
+    def start_song(self, ctx: commands.Context, voice: VoiceClient, song: Song) -> str:
+        """Add a song to the queue and play it if nothing else is playing."""
+
+        settings = self.guild_voice[ctx.guild.id]
         settings.queue.put(song)
         settings.last_song = song
+        self.idle.cancel(ctx.guild.id)
+        self.prefetch(ctx)
 
-        if voice.is_playing():
+        # The first song in the queue is the one playing,
+        # it might still be buffering before it starts
+        if voice.is_playing() or voice.is_paused() or len(settings.queue) > 1:
             log("Song added to queue.", level=logging.INFO)
-            self._result = "Song added to queue."
+            return "Song added to queue."
+
+        self.play_song(ctx, voice, song)
+        return "Playing song."
+
+    async def queue_songs(
+        self,
+        ctx: commands.Context,
+        voice: VoiceClient,
+        songs: list[Song],
+    ) -> int:
+        """Add songs of a playlist to the queue and return how many fit.
+
+        The first one is played if nothing else is playing.
+        """
+
+        settings = self.guild_voice[ctx.guild.id]
+        idle = settings.queue.empty()
+
+        added = 0
+        for song in songs:
+            if not settings.queue.put(song, self.bot.settings.playlist_max_size):
+                break
+            added += 1
+
+        if not added:
+            return 0
+
+        self.idle.cancel(ctx.guild.id)
+        self.prefetch(ctx)
+
+        if idle and not (voice.is_playing() or voice.is_paused()):
+            settings.last_song = songs[0]
+            self.play_song(ctx, voice, songs[0])
+
+        return added
+
+    def play_song(
+        self,
+        ctx: commands.Context,
+        voice: VoiceClient,
+        song: Song,
+        ended: Optional[float] = None,
+        position: float = 0.0,
+    ) -> None:
+        """Start playing a song once enough of it is buffered.
+
+        `ended` is the time the previous song ended, if it's
+        played right after it, to measure the gap between them.
+        `position` is the time in seconds to start the song from.
+        """
+
+        settings = self.guild_voice[ctx.guild.id]
+        lead = self.bot.settings.gapless_lead
+
+        def first_frame(startup: float, now: float):
+            metrics.FFMPEG_STARTUP_SECONDS.observe(startup)
+            if ended is not None:
+                metrics.TRANSITION_SECONDS.observe(now - ended)
+
+        def near_end(playlist: GaplessSource):
+            self.bot.loop.call_soon_threadsafe(self.prewarm, ctx, playlist)
+
+        def start():
+            # The song was skipped or the bot left while it was buffering
+            if settings.queue.peek() is not song or not voice.is_connected():
+                return
+
+            self.buffers.touch(song)
+            source = self.open_decoder(song, settings.volume, position, first_frame)
+
+            # The next songs are started from this source when they are ready
+            if lead > 0:
+                source = GaplessSource(
+                    source,
+                    song,
+                    lead,
+                    self.bot.settings.crossfade,
+                    near_end,
+                    functools.partial(self.switch_song, ctx),
+                )
+
+            source = with_volume(
+                source, settings.volume, self.bot.settings.opus_passthrough
+            )
+            voice.play(source, after=self.play_next_song(ctx))
+
+        if song.downloaded:
+            return start()
+
+        # Wait for the whole song if streaming is disabled
+        prebuffer = math.inf
+        if self.bot.settings.stream_playback:
+            prebuffer = self.bot.settings.stream_prebuffer
+
+        song.buffer().when_buffered(prebuffer, start)
+
+    def open_decoder(
+        self,
+        song: Song,
+        volume: int,
+        position: float = 0.0,
+        on_first_frame=None,
+    ) -> TrackedSource:
+        """Start decoding a song from `position`, with its loudness normalized."""
+
+        gain = normalization_gain(
+            song.loudness,
+            self.bot.settings.loudness_target,
+            self.bot.settings.loudness_tolerance,
+        )
+        fp, skip = song.open_at(position)
+        return create_decoder(
+            fp,
+            volume,
+            song.codec,
+            self.bot.settings.opus_passthrough,
+            on_first_frame,
+            gain,
+            position,
+            skip,
+            song.name,
+            self.bot.settings.decoder_timeout,
+        )
+
+    def prewarm(self, ctx: commands.Context, playlist: GaplessSource) -> None:
+        """Start the decoder of the song after the one playing."""
+
+        settings = self.guild_voice[ctx.guild.id]
+        if settings.seek is not None:
+            return
+
+        if settings.loop:
+            song = settings.queue.peek()
+        elif len(settings.queue) > 1:
+            song = settings.queue[1]
+        else:
+            return
+
+        # A song that is still downloading starts after the usual prebuffer
+        if song is None or not song.downloaded:
             return
 
-        audio = discord.FFmpegPCMAudio(buffer, pipe=True, stderr=subprocess.PIPE)
-        source = discord.PCMVolumeTransformer(audio)
-        source.volume = settings.volume / 100
-        voice.play(source, after=self.play_next_song(ctx))
+        self.bot.loop.run_in_executor(None, self.prime_next, ctx, playlist, song)
+
+    def prime_next(
+        self, ctx: commands.Context, playlist: GaplessSource, song: Song
+    ) -> None:
+        """Decode the first frame of the next song and hand it to the player."""
+
+        volume = self.guild_voice[ctx.guild.id].volume
+
+        try:
+            started = time.perf_counter()
+            source = self.open_decoder(song, volume)
+        except Exception as e:
+            return log(
+                "Could not start the next song.",
+                e,
+                level=logging.WARNING,
+                guild=ctx.guild.id,
+            )
+
+        try:
+            primed = source.prime()
+        except Exception as e:
+            log(
+                "Could not start the next song.",
+                e,
+                level=logging.WARNING,
+                guild=ctx.guild.id,
+            )
+            primed = False
+
+        if not primed:
+            return source.cleanup()
+
+        metrics.FFMPEG_STARTUP_SECONDS.observe(time.perf_counter() - started)
+        playlist.queue_next(song, source, volume)
+
+    def switch_song(self, ctx: commands.Context, song: Song, volume: int) -> bool:
+        """Check if the primed song still plays next, and move the queue to it.
+
+        Called from the player thread when the current song ends.
+        """
+
+        settings = self.guild_voice[ctx.guild.id]
+        if settings.seek is not None:
+            return False
+
+        # Opus decoders keep the volume they were started with
+        if self.bot.settings.opus_passthrough and volume != settings.volume:
+            return False
+
+        if settings.loop:
+            if settings.queue.peek() is not song:
+                return False
+        else:
+            if len(settings.queue) < 2 or settings.queue[1] is not song:
+                return False
+
+            settings.queue.pop()
+            self.bot.loop.call_soon_threadsafe(self.prefetch, ctx)
+
+        settings.touch()
+        self.buffers.touch(song)
+        metrics.TRANSITION_SECONDS.observe(0.0)
+        return True
+
+    def drop_song(self, ctx: commands.Context, song: Song) -> None:
+        """Remove a song that can't be played from the queue and move on."""
+
+        settings = self.guild_voice.get(ctx.guild.id)
+        if settings is None:
+            return
+
+        queued = [i for i, other in enumerate(settings.queue) if other is song]
+        if not queued:
+            return
 
-        self._result = "Playing song."
+        if queued[0]:
+            settings.queue.remove(queued[0])
+            return self.prefetch(ctx)
+
+        # Stopping the song plays the next one, without looping it
+        voice = ctx.guild.voice_client
+        settings.loop = False
+        if voice and (voice.is_playing() or voice.is_paused()):
+            return voice.stop()
+
+        # The song never started, start the next one instead
+        settings.queue.pop()
+        self.prefetch(ctx)
+
+        song = settings.queue.peek()
+        if voice and song is not None:
+            self.play_song(ctx, voice, song)
+        else:
+            self.idle.arm(ctx.guild.id)
+
+    def notify(self, ctx: commands.Context, message: str) -> None:
+        """Send a message from a worker thread."""
+
+        asyncio.run_coroutine_threadsafe(ctx.send(message), self.bot.loop)
 
     @commands.command(name="replay", description="Replay the last song.")
     async def replay(self, ctx: commands.Context):
         """Replay the last song."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
 
         # If the bot is not in a voice channel exit
         voice: VoiceClient = ctx.guild.voice_client
@@ -183,23 +1119,21 @@ class VoiceCog(commands.Cog):
             return await ctx.send("There is no last song.")
 
         # Can't play song if there is another one already playing
-        if voice.is_playing():
+        if voice.is_playing() or voice.is_paused():
             return await ctx.send("There is already a song playing.")
 
-        buffer = settings.last_song.data
-        buffer.seek(0)
+        # The first song in the queue is still buffering before it starts
+        if not settings.queue.empty():
+            return await ctx.send("The next song is still loading.")
 
-        # Play the last song
-        audio = discord.FFmpegPCMAudio(buffer, pipe=True, stderr=subprocess.PIPE)
-        source = discord.PCMVolumeTransformer(audio)
-        source.volume = settings.volume / 100
-        voice.play(source, after=self.play_next_song(ctx))
+        # Queue the last song again, so it plays like any other song
+        self.start_song(ctx, voice, settings.last_song)
 
     @commands.command(name="loop", description="Loop current song.")
     async def loop(self, ctx: commands.Context):
         """Loop current playing son indefinitely."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
         settings.loop = not settings.loop
 
         action = "L" if settings.loop else "Stopped l"
@@ -209,7 +1143,7 @@ class VoiceCog(commands.Cog):
     async def queue(self, ctx: commands.Context):
         """Show the current queue."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
 
         # If the bot is not in a voice channel exit
         voice: VoiceClient = ctx.guild.voice_client
@@ -219,19 +1153,20 @@ class VoiceCog(commands.Cog):
         if settings.queue.empty():
             return await ctx.send("No song currently queued.")
 
-        # Create the embed
-        songs = settings.queue.queue
+        # Create the embed, playlists can be too long to show whole
+        songs = list(islice(settings.queue, QUEUE_PAGE_SIZE))
+        description = "\n".join(
+            f"{i + 1}. **{song.name}**\n{song.link}" for i, song in enumerate(songs)
+        )
+        if len(settings.queue) > len(songs):
+            description += f"\n\n...and {len(settings.queue) - len(songs)} more."
+
         embed = discord.Embed(
             title="Queue",
-            description="\n".join(
-                [
-                    f"{i + 1}. **{song.name}**\n{song.link}"
-                    for i, song in enumerate(songs)
-                ]
-            ),
+            description=description,
             color=discord.Color.blurple(),
         )
-        embed.set_thumbnail(url=settings.queue.queue[0].thumbnail)
+        embed.set_thumbnail(url=settings.queue.peek().thumbnail)
 
         return await ctx.send(embed=embed)
 
@@ -239,7 +1174,7 @@ class VoiceCog(commands.Cog):
     async def now_playing(self, ctx: commands.Context):
         """Show the currently playing song."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
 
         # If the bot is not in a voice channel exit
         voice: VoiceClient = ctx.guild.voice_client
@@ -254,7 +1189,7 @@ class VoiceCog(commands.Cog):
             return await ctx.send("No song currently queued.")
 
         # Get the song that is currently playing
-        song: Song = settings.queue.queue[0]
+        song: Song = settings.queue.peek()
 
         # Create the embed
         embed = discord.Embed(
@@ -265,6 +1200,13 @@ class VoiceCog(commands.Cog):
         embed.set_thumbnail(url=song.thumbnail)
         embed.set_footer(text=f"Requested by {song.requester}")
 
+        position = playback_position(voice.source)
+        if position is not None:
+            embed.add_field(
+                name="Position",
+                value=f"{format_timestamp(position)} / {format_timestamp(song.duration)}",
+            )
+
         return await ctx.send(embed=embed)
 
     @commands.command(name="join", description="Join a voice channel.")
@@ -287,8 +1229,10 @@ class VoiceCog(commands.Cog):
 
             return await ctx.send(f"Moved to {channel.mention}.")
 
-        # Connect to the voice channel
+        # Connect to the voice channel,
+        # and leave if nothing is played
         await channel.connect()
+        self.idle.arm(ctx.guild.id)
         return await ctx.send(f"Joined {channel.mention}.")
 
     @commands.command(name="leave", description="Leave a voice channel.")
@@ -309,7 +1253,7 @@ class VoiceCog(commands.Cog):
     async def volume(self, ctx: commands.Context, volume: int):
         """Change the volume of the player."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
 
         # If the bot is not in a voice channel exit
         voice: VoiceClient = ctx.guild.voice_client
@@ -318,6 +1262,17 @@ class VoiceCog(commands.Cog):
 
         # Change the volume of the player
         settings.volume = volume
+
+        # Opus sources get their volume from ffmpeg when they start,
+        # so play the song again from where it is, like a seek does
+        if not isinstance(voice.source, discord.PCMVolumeTransformer):
+            position = playback_position(voice.source)
+            if position is not None and settings.seek is None:
+                settings.seek = position
+                voice.stop()
+
+            return await ctx.send(f"Changed the volume to {volume}%")
+
         voice.source.volume = settings.volume / 100
         return await ctx.send(f"Changed the volume to {volume}%")
 
@@ -348,42 +1303,87 @@ class VoiceCog(commands.Cog):
         # Play the next song in the queue
         self.play_next_song(ctx)
 
+    @commands.command(name="seek", description="Move to a time of the current song.")
+    async def seek(self, ctx: commands.Context, timestamp: str):
+        """Move to a time of the current song, given as mm:ss or seconds."""
+
+        settings = self.guild_voice[ctx.guild.id]
+
+        # If the bot is not in a voice channel exit
+        voice: VoiceClient = ctx.guild.voice_client
+        if not voice:
+            return await ctx.send("I am not in a voice channel.")
+
+        # If the user is not in a voice channel exit
+        if not ctx.author.voice:
+            return await ctx.send("You are not in a voice channel.")
+
+        # If the user is not in the same voice channel as the bot exit
+        if ctx.author.voice.channel != voice.channel:
+            return await ctx.send("You are not in the same voice channel as me.")
+
+        song = settings.queue.peek()
+        if not song or not (voice.is_playing() or voice.is_paused()):
+            return await ctx.send("There is no song currently playing.")
+
+        position = parse_timestamp(timestamp)
+        if position is None:
+            return await ctx.send("Give the time as mm:ss or a number of seconds.")
+
+        if song.duration and position >= song.duration:
+            return await ctx.send("The song isn't that long.")
+
+        # Stopping the song plays it again from the new position
+        settings.seek = position
+        voice.stop()
+
+        await ctx.send(f"Moved to {format_timestamp(position)}.")
+
     def play_next_song(self, ctx: commands.Context):
         """Play the next song in the queue."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
 
         def inner(error):
-            if error:
-                return
+            ended = time.perf_counter()
+
+            # A seek only applies to the song that was stopped for it
+            position, settings.seek = settings.seek, None
 
             voice = ctx.guild.voice_client
             if not voice:
                 return
 
+            # Leave the channel if nothing plays after this song
+            if error:
+                return self.idle.arm_threadsafe(ctx.guild.id)
+
+            settings.touch()
+
+            # Play the song again from the position it was moved to
+            if position is not None:
+                song = settings.queue.peek()
+                if song is not None:
+                    return self.play_song(ctx, voice, song, ended, position)
+
             # If loop is set to True,
             # then we need to just replay the current song.
-            if settings.loop:
-                song = settings.queue.queue[0]
-                song.data.seek(0)
-            else:
+            if not settings.loop:
                 # Remove current playing song
                 # and play the next one in the queue
-                if settings.queue.empty():
-                    return
-
-                settings.queue.get()
+                if settings.queue.pop() is None:
+                    return self.idle.arm_threadsafe(ctx.guild.id)
 
-                if settings.queue.empty():
-                    return
+                # Cancel the download of a skipped song
+                # and start the ones that are now up next
+                self.bot.loop.call_soon_threadsafe(self.prefetch, ctx)
 
-                song = settings.queue.queue[0]
+            song = settings.queue.peek()
+            if song is None:
+                return self.idle.arm_threadsafe(ctx.guild.id)
 
             # Start playing next song
-            audio = discord.FFmpegPCMAudio(song.data, pipe=True, stderr=subprocess.PIPE)
-            source = discord.PCMVolumeTransformer(audio)
-            source.volume = settings.volume / 100
-            voice.play(source, after=self.play_next_song(ctx))
+            self.play_song(ctx, voice, song, ended)
 
         return inner
 
@@ -391,7 +1391,8 @@ class VoiceCog(commands.Cog):
     async def play(self, ctx: commands.Context, *, query: str):
         """Play a song using the spotify API library."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
+        settings.text_channel = ctx.channel.id
 
         if settings.queue.full():
             return await ctx.send("The queue is full.")
@@ -406,30 +1407,77 @@ class VoiceCog(commands.Cog):
             await ctx.author.voice.channel.connect()
             voice = ctx.guild.voice_client
 
+            # Leave again if no song ends up playing, starting one disarms it
+            self.idle.arm(ctx.guild.id)
+
         # If the user is not in the same voice channel as the bot exit
         if ctx.author.voice.channel != voice.channel:
             return await ctx.send("You are not in the same voice channel as me.")
 
-        # Only allow youtube links since the bot only uses yt-dlp
-        if not query.startswith("https://www.youtube.com/watch?v="):
-            await ctx.send("You need to provide a valid Youtube link.")
-            return
+        if is_playlist(query):
+            return await self.play_playlist(ctx, voice, query)
 
-        if self.__lock:
-            await ctx.send("Your download will start shortly.")
-            args = self.DownloadArgs(ctx, voice, query)
-            self.__next_download.put(args)
+        # Only allow youtube links since the bot only uses yt-dlp,
+        # anything else is searched
+        if query.startswith("http") and not query.startswith(
+            "https://www.youtube.com/watch?v="
+        ):
+            await ctx.send("You need to provide a valid Youtube link.")
             return
 
-        self.__lock = True
+        # Let the user know if the search has to wait for others
+        if self.scheduler.is_busy(ctx.guild.id):
+            await ctx.send("Your song will be queued shortly.")
 
-        await ctx.send("Downloading...")
         async with ctx.typing():
-            loop = self.bot.loop
-            await loop.run_in_executor(None, self.queue_song, ctx, voice, query)
-            await ctx.send(self._result)
+            try:
+                song = await self.scheduler.submit(
+                    ctx.guild.id,
+                    self.resolve_song,
+                    query,
+                )
+            except SongError as e:
+                return await ctx.send(str(e))
 
-        self.__lock = False
+            if settings.queue.full():
+                return await ctx.send("The queue is full.")
+
+            song.requester = ctx.author.name
+            await ctx.send(self.start_song(ctx, voice, song))
+
+    async def play_playlist(self, ctx: commands.Context, voice: VoiceClient, url: str):
+        """Add the songs of a playlist to the queue as they are listed."""
+
+        # Only one playlist can be added at a time, it's registered
+        # before the first await so a second one can't slip in
+        if ctx.guild.id in self._playlists:
+            return await ctx.send("A playlist is already being added.")
+
+        stop = threading.Event()
+        self._playlists[ctx.guild.id] = stop
+
+        # Listing waits for the queue between pages, so it runs
+        # outside the download workers to not hold one of them
+        context = contextvars.copy_context()
+        try:
+            await ctx.send("Adding the playlist to the queue.")
+            added = await self.bot.loop.run_in_executor(
+                None,
+                context.run,
+                self.ingest_playlist,
+                ctx,
+                voice,
+                url,
+                stop,
+            )
+        except Exception as e:
+            log("Can't list playlist.", e, level=logging.ERROR)
+            return await ctx.send("Can't load the playlist.")
+        finally:
+            if self._playlists.get(ctx.guild.id) is stop:
+                del self._playlists[ctx.guild.id]
+
+        await ctx.send(f"Added {added} songs from the playlist.")
 
     @commands.command(name="pause", description="Pause the player.")
     async def pause(self, ctx: commands.Context):
@@ -440,8 +1488,10 @@ class VoiceCog(commands.Cog):
         if not voice:
             return await ctx.send("I am not in a voice channel.")
 
-        # Pause the player
+        # Pause the player,
+        # and leave if it isn't resumed
         voice.pause()
+        self.idle.arm(ctx.guild.id)
         return await ctx.send("Paused the player.")
 
     @commands.command(name="resume", description="Resume the player.")
@@ -455,13 +1505,14 @@ class VoiceCog(commands.Cog):
 
         # Resume the player
         voice.resume()
+        self.idle.cancel(ctx.guild.id)
         return await ctx.send("Resumed the player.")
 
     @commands.command(name="stop", description="Stop the player.")
     async def stop(self, ctx: commands.Context):
         """Stop the player."""
 
-        settings = self.guild_voice[ctx.guild]
+        settings = self.guild_voice[ctx.guild.id]
 
         # If the bot is not in a voice channel exit
         voice: VoiceClient = ctx.guild.voice_client
@@ -470,8 +1521,11 @@ class VoiceCog(commands.Cog):
 
         # Stop the player, clear the queue
         # and reset the loop flag
+        self.stop_playlist(ctx.guild.id)
         voice.stop()
-        settings.queue.queue.clear()
+        settings.queue.clear()
         settings.loop = False
+        self.prefetch(ctx)
+        self.idle.arm(ctx.guild.id)
 
         await ctx.send("Stopped the player and cleared queue.")
@@ -0,0 +1,173 @@
+import logging
+import subprocess
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Optional
+
+import discord
+
+from bnss.logger import log
+
+# Seconds to wait for a killed ffmpeg to exit
+KILL_TIMEOUT = 5
+# Seconds to wait for the thread writing the song to ffmpeg to stop
+WRITER_TIMEOUT = 1
+
+
+class FFmpegLog:
+    """File-like sink for the stderr of ffmpeg.
+
+    discord.py drains it in a thread and writes it here,
+    every line is logged and the last ones are kept.
+    """
+
+    def __init__(self, name: str, lines: int = 20):
+        self.name = name
+        self.lines: deque[str] = deque(maxlen=lines)
+        self._partial = b""
+
+    def write(self, data: bytes) -> int:
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        for line in lines:
+            line = line.decode(errors="replace").strip()
+            if line:
+                self.lines.append(line)
+                log(f"ffmpeg [{self.name}]", line, level=logging.DEBUG)
+
+        return len(data)
+
+
+class Decoder(discord.AudioSource):
+    """ffmpeg source that is watched and always reaped.
+
+    Reads that block for longer than `timeout` seconds kill ffmpeg,
+    so a hung or starved decoder ends the song instead of the
+    player. The first frame can be decoded ahead of time with
+    `prime`, so playing it doesn't wait for ffmpeg to start.
+    """
+
+    def __init__(
+        self, original: discord.FFmpegAudio, stderr: FFmpegLog, timeout: float
+    ):
+        self.original = original
+        self.stderr = stderr
+        self.timeout = timeout
+        self.killed = False
+
+        # discord.py doesn't expose the process, it's needed to reap it
+        self._process: subprocess.Popen = original._process
+        self._primed: Optional[bytes] = None
+        self._reading_since: Optional[float] = None
+
+        WATCHDOG.add(self)
+
+    def prime(self) -> bool:
+        """Decode the first frame now, return whether there is one."""
+
+        if self._primed is None:
+            self._primed = self.read()
+
+        return bool(self._primed)
+
+    def read(self) -> bytes:
+        primed, self._primed = self._primed, None
+        if primed is not None:
+            return primed
+
+        self._reading_since = time.monotonic()
+        try:
+            return self.original.read()
+        finally:
+            self._reading_since = None
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def stalled(self, now: float) -> bool:
+        """Check if a read is blocked for longer than the timeout."""
+
+        since = self._reading_since
+        return since is not None and now - since > self.timeout
+
+    def kill(self) -> None:
+        """Stop ffmpeg, a blocked read returns once it exits."""
+
+        self.killed = True
+        try:
+            self._process.kill()
+        except OSError:
+            pass
+
+    def cleanup(self) -> None:
+        WATCHDOG.discard(self)
+        self.kill()
+
+        # Reap the process before discord.py tries to. Its pipe writer
+        # may have closed stdin already, which makes its cleanup raise.
+        try:
+            self._process.wait(KILL_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            log("ffmpeg didn't exit.", self._process.pid, level=logging.WARNING)
+
+        # The stdin writer stops at its next write, it fails if
+        # discord.py already let go of the process by then
+        writer = getattr(self.original, "_pipe_writer_thread", None)
+        if writer is not None:
+            writer.join(WRITER_TIMEOUT)
+
+        self.original.cleanup()
+
+
+class Watchdog:
+    """Kill decoders whose reads are stuck.
+
+    Runs in a thread that's started with the first decoder.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+
+        self._decoders: weakref.WeakSet[Decoder] = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._decoders)
+
+    def add(self, decoder: Decoder) -> None:
+        with self._lock:
+            self._decoders.add(decoder)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="decoder-watchdog",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def discard(self, decoder: Decoder) -> None:
+        with self._lock:
+            self._decoders.discard(decoder)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+
+            now = time.monotonic()
+            with self._lock:
+                stalled = [d for d in self._decoders if d.stalled(now)]
+
+            for decoder in stalled:
+                log(
+                    "Killing stalled ffmpeg.",
+                    decoder.stderr.name,
+                    list(decoder.stderr.lines),
+                    level=logging.WARNING,
+                )
+                decoder.kill()
+
+
+WATCHDOG = Watchdog()
@@ -0,0 +1,136 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Optional
+
+from bnss.audio import StreamBuffer
+
+
+class _Call:
+    """Result of a call shared by concurrent callers."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Run a function once for all the concurrent callers with the same key.
+
+    The first caller runs it, the others wait for its result
+    or its exception. Once it returns, the next caller runs it again.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+        return call.result
+
+
+class Flight:
+    """A download shared by every caller that wants the same song.
+
+    The downloader writes to the flight like a file, into the buffer
+    of the first caller. The other callers read that buffer with
+    their own cursor, so callers that join late get what was written
+    so far. A caller that doesn't want the song anymore cancels its
+    share of the buffer, the download is only cancelled once no caller
+    is left.
+
+    `future` gets the result of the download, callers add
+    callbacks to it instead of blocking a thread until it lands.
+    """
+
+    def __init__(self, stream: StreamBuffer):
+        self.stream = stream
+        self.future: Future = Future()
+
+    def join(self) -> bool:
+        """Share the buffer of the flight, unless the download is over."""
+
+        return not self.future.done() and self.stream.share()
+
+    def write(self, data: bytes) -> int:
+        return self.stream.write(data)
+
+    def flush(self) -> None:
+        pass
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None):
+        """Hand the result, or the exception, of the download to the callers."""
+
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class Flights:
+    """Downloads in progress, keyed by video ID.
+
+    `join` returns the flight of a key and whether the caller
+    is the first one, which has to run the download into its
+    stream and `land` it. The other callers share that stream.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: Hashable, stream: StreamBuffer) -> tuple[Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.join():
+                return flight, False
+
+            flight = self._flights[key] = Flight(stream)
+            return flight, True
+
+    def land(
+        self,
+        key: Hashable,
+        flight: Flight,
+        result: Any = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Finish a flight, callers that join later start a new one."""
+
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight.finish(result, error)
@@ -1,7 +1,18 @@
-from dataclasses import dataclass
-from io import BytesIO
-from queue import Queue
-from typing import Optional
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+from bnss.audio import BufferReader, MappedAudio, SeekIndex, StreamBuffer
+
+_song_lock = threading.Lock()
 
 
 @dataclass
@@ -11,7 +22,131 @@ class Song:
     duration: Optional[int] = 0
     thumbnail: Optional[str] = ""
     requester: Optional[str] = ""
-    data: Optional[BytesIO] = None
+    codec: Optional[str] = ""
+    loudness: Optional[float] = None
+    data: Optional[StreamBuffer] = None
+    stream: Optional[StreamBuffer] = None
+    path: Optional[str] = None
+    mapped: Optional[MappedAudio] = None
+    index: Optional[SeekIndex] = field(default=None, repr=False)
+
+    def open(self) -> IO[bytes]:
+        """Return a new reader for the audio of the song.
+
+        Every reader has its own position, so the same song can
+        be played several times at once. The audio is read from
+        a file shared with other songs, from memory, or from disk
+        if it was moved there. If the song is still downloading,
+        the reader blocks until the next chunk is available.
+        """
+
+        mapped = self.mapped
+        if mapped is not None:
+            return mapped.reader()
+
+        data = self.data
+        if data is not None:
+            return BufferReader(data.getbuffer())
+
+        if self.path is not None:
+            return MappedAudio.open(self.path).reader()
+
+        return self.buffer().reader()
+
+    def open_at(self, position: float) -> tuple[IO[bytes], float]:
+        """Return a new reader for the audio from about `position` seconds.
+
+        Downloaded songs start at the closest point before `position`
+        in their seek index. Also returns the seconds left to skip.
+        """
+
+        audio = self._audio()
+        if position <= 0 or audio is None:
+            return self.open(), max(0.0, position)
+
+        index = self.seek_index()
+        if index is None:
+            return BufferReader(audio), position
+
+        return index.reader(audio, position)
+
+    def seek_index(self) -> Optional[SeekIndex]:
+        """Return the seek index of a downloaded song, building it if needed."""
+
+        if self.index is None:
+            audio = self._audio()
+            if audio is not None:
+                self.index = SeekIndex.build(audio)
+
+        return self.index
+
+    def _audio(self):
+        """Return the whole audio of a downloaded song as a buffer."""
+
+        mapped = self.mapped
+        if mapped is not None:
+            return mapped.data
+
+        data = self.data
+        if data is not None:
+            return data.getbuffer()
+
+        if self.path is not None:
+            return MappedAudio.open(self.path).data
+
+        return None
+
+    def buffer(self) -> StreamBuffer:
+        """Return the buffer the song is downloaded into, creating it if needed."""
+
+        with _song_lock:
+            if self.stream is None:
+                self.stream = StreamBuffer()
+
+            return self.stream
+
+    def share_buffer(self, stream: StreamBuffer) -> bool:
+        """Read the song from `stream`, downloaded for another song.
+
+        Returns False if the download of the song was cancelled.
+        """
+
+        with _song_lock:
+            own = self.stream
+            if own is None or own.cancelled:
+                return False
+
+            self.stream = stream
+
+        own.forward(stream)
+        return True
+
+    def cancel(self) -> None:
+        """Cancel the download of the song, unless it's already downloaded."""
+
+        with _song_lock:
+            stream, self.stream = self.stream, None
+
+        if stream is not None and not self.downloaded:
+            stream.cancel()
+
+    @property
+    def downloaded(self) -> bool:
+        """Check if the whole song is in memory or on disk."""
+
+        return any(audio is not None for audio in (self.mapped, self.data, self.path))
+
+    @property
+    def size(self) -> int:
+        """Return the number of audio bytes held in memory."""
+
+        if self.data is not None:
+            return self.data.getbuffer().nbytes
+
+        if self.stream is not None:
+            return len(self.stream)
+
+        return 0
 
     @staticmethod
     def _from_info(info: dict) -> "Song":
@@ -22,17 +157,237 @@ class Song:
             link=info["webpage_url"],
             duration=info["duration"],
             thumbnail=info["thumbnail"],
+            codec=info.get("acodec", ""),
+            loudness=info.get("loudness"),
         )
 
+    @staticmethod
+    def _from_entry(entry: dict) -> "Song":
+        """Load a placeholder from a flat playlist entry.
 
-@dataclass
+        The rest of the info is extracted when the song is downloaded.
+        """
+
+        thumbnails = entry.get("thumbnails") or [{}]
+        return Song(
+            name=entry.get("title") or "",
+            link=f"https://www.youtube.com/watch?v={entry['id']}",
+            duration=entry.get("duration") or 0,
+            thumbnail=thumbnails[-1].get("url", ""),
+        )
+
+    @staticmethod
+    def _from_snapshot(info: dict) -> "Song":
+        """Load a queued song saved by `_to_snapshot`."""
+
+        song = Song._from_info(info)
+        song.requester = info.get("requester", "")
+        return song
+
+    def _to_snapshot(self) -> dict:
+        """Return the info dict needed to queue the song again after a restart."""
+
+        return {**self._to_info(), "requester": self.requester}
+
+    def _to_info(self) -> dict:
+        """Return the info dict needed to load the song again."""
+
+        return {
+            "title": self.name,
+            "webpage_url": self.link,
+            "duration": self.duration,
+            "thumbnail": self.thumbnail,
+            "acodec": self.codec,
+            "loudness": self.loudness,
+        }
+
+
+class SongQueue:
+    """Bounded queue of songs.
+
+    The first song in the queue is the one playing.
+    Adding, peeking and popping at either end is O(1),
+    removing or moving a song is O(maxsize).
+    """
+
+    __slots__ = ("_songs", "maxsize")
+
+    def __init__(self, maxsize: int = 10):
+        self._songs: deque[Song] = deque()
+        self.maxsize = maxsize
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def __iter__(self) -> Iterator[Song]:
+        return iter(self._songs)
+
+    def __getitem__(self, index: int) -> Song:
+        return self._songs[index]
+
+    def empty(self) -> bool:
+        return not self._songs
+
+    def full(self) -> bool:
+        return len(self._songs) >= self.maxsize
+
+    def put(self, song: Song, limit: Optional[int] = None) -> bool:
+        """Add a song at the end of the queue, if there is room.
+
+        `limit` overrides the size of the queue, for playlists.
+        """
+
+        if len(self._songs) >= (limit or self.maxsize):
+            return False
+
+        self._songs.append(song)
+        return True
+
+    def peek(self) -> Optional[Song]:
+        """Return the first song without removing it."""
+
+        return self._songs[0] if self._songs else None
+
+    def pop(self) -> Optional[Song]:
+        """Remove and return the first song."""
+
+        return self._songs.popleft() if self._songs else None
+
+    def remove(self, index: int) -> Song:
+        """Remove and return the song at `index`."""
+
+        song = self._songs[index]
+        del self._songs[index]
+        return song
+
+    def clear(self) -> None:
+        self._songs.clear()
+
+
+@dataclass(slots=True)
 class VoiceSettings:
-    queue: Queue = Queue(maxsize=10)
+    queue: SongQueue = field(default_factory=SongQueue)
     loop: bool = False
     volume: int = 100
     last_song: Optional[Song] = None
+    seek: Optional[float] = None
+    last_active: float = field(default_factory=time.monotonic)
+    # Text channel of the last song request, for resuming after a restart
+    text_channel: Optional[int] = None
+
+    def touch(self) -> None:
+        """Mark the guild as active."""
+
+        self.last_active = time.monotonic()
+
+
+class SongError(Exception):
+    """Raised when a song can't be queued.
+
+    The message of the exception is sent to the user.
+    """
+
+
+def video_id(url: str) -> Optional[str]:
+    """Return the video ID of a Youtube link."""
+
+    ids = parse_qs(urlparse(url).query).get("v")
+    if not ids:
+        return None
+
+    return ids[0]
+
+
+def parse_timestamp(text: str) -> Optional[int]:
+    """Return the seconds of a `[hh:]mm:ss` timestamp, or of a number of seconds."""
+
+    parts = text.split(":")
+    if len(parts) > 3 or not all(part.isdigit() for part in parts):
+        return None
+
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+
+    return seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    """Format seconds as `[h:]mm:ss`."""
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+
+    return f"{minutes}:{seconds:02}"
+
+
+def is_playlist(url: str) -> bool:
+    """Check if a link is a Youtube playlist."""
+
+    parsed = urlparse(url)
+    return (
+        parsed.netloc == "www.youtube.com"
+        and parsed.path == "/playlist"
+        and "list" in parse_qs(parsed.query)
+    )
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write a file atomically, so readers never see half of it."""
+
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class _StdoutRouter:
+    """Stand-in for `sys.stdout` that can redirect writes per thread.
+
+    yt-dlp writes the downloaded file to stdout when `outtmpl` is "-".
+    `contextlib.redirect_stdout` swaps `sys.stdout` for the whole process,
+    so concurrent downloads would write into each other's buffers.
+    """
+
+    def __init__(self, default: IO):
+        self._default = default
+        self._local = threading.local()
+
+    def _target(self) -> IO:
+        target = getattr(self._local, "target", None)
+        return self._default if target is None else target
+
+    def __getattr__(self, name: str):
+        return getattr(self._target(), name)
+
+    def write(self, data):
+        return self._target().write(data)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+
+_router_lock = threading.Lock()
+
+
+@contextmanager
+def capture_stdout(target: IO) -> Iterator[IO]:
+    """Redirect stdout of the current thread only into `target`."""
 
-    def copy(self):
-        """Return a new instance of the current settings."""
+    with _router_lock:
+        if not isinstance(sys.stdout, _StdoutRouter):
+            sys.stdout = _StdoutRouter(sys.stdout)
 
-        return VoiceSettings(self.queue, self.loop, self.volume)
+    router: _StdoutRouter = sys.stdout
+    previous = getattr(router._local, "target", None)
+    router._local.target = target
+    try:
+        yield target
+    finally:
+        router._local.target = previous
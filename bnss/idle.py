@@ -0,0 +1,65 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class IdleTimers:
+    """Disconnect timers of idle guilds.
+
+    A timer is armed when a guild stops playing and is cancelled
+    by any new activity. If it isn't cancelled within `grace`
+    seconds, `callback` is called with the guild. Arming and
+    cancelling a timer is O(1), whatever the number of guilds.
+
+    Must be used from the event loop thread, use `arm_threadsafe`
+    from the threads of the voice clients.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        grace: float,
+        callback: Callable[[Hashable], Awaitable[None]],
+    ):
+        self.loop = loop
+        self.grace = grace
+        self.callback = callback
+
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+
+    def __contains__(self, guild: Hashable) -> bool:
+        return guild in self._timers
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def arm(self, guild: Hashable) -> None:
+        """Start the idle timer of a guild, restarting it if it's running."""
+
+        self.cancel(guild)
+        self._timers[guild] = self.loop.call_later(self.grace, self._fire, guild)
+
+    def arm_threadsafe(self, guild: Hashable) -> None:
+        """Start the idle timer of a guild from another thread."""
+
+        self.loop.call_soon_threadsafe(self.arm, guild)
+
+    def cancel(self, guild: Hashable) -> None:
+        """Stop the idle timer of a guild, if it's running."""
+
+        timer = self._timers.pop(guild, None)
+        if timer is not None:
+            timer.cancel()
+
+    def clear(self) -> None:
+        """Stop every timer."""
+
+        for timer in self._timers.values():
+            timer.cancel()
+
+        self._timers.clear()
+
+    def _fire(self, guild: Hashable) -> None:
+        """Run the callback of a guild that stayed idle."""
+
+        del self._timers[guild]
+        self.loop.create_task(self.callback(guild))
@@ -1,10 +1,39 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
-from typing import Any
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Optional
 
+# Correlation fields added to every message logged in the current context
+_context: ContextVar[dict[str, Any]] = ContextVar("log_context", default={})
 
-def log(*message: Any, level: int | None = None) -> None:
-    """Format message and log"""
+# Writes the queued messages, started by `setup_logger`
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class _Message:
+    """Message joined from the arguments of `log` when it's formatted."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: tuple):
+        self.items = items
+
+    def __str__(self) -> str:
+        return " ".join(str(item) for item in self.items)
+
+
+def log(*message: Any, level: int | None = None, **fields: Any) -> None:
+    """Format message and log
+
+    Nothing is formatted if the level is filtered out.
+    `fields` are added to the correlation fields of the context.
+    """
 
     logger = logging.getLogger("BNSS")
 
@@ -12,36 +41,159 @@ def log(*message: Any, level: int | None = None) -> None:
     if not level:
         level = logger.level
 
-    # Log message and save previous log
-    message = " ".join(str(item) for item in message)
-    logger.log(level, message)
+    if not logger.isEnabledFor(level):
+        return
+
+    logger.log(level, _Message(message), extra={"fields": fields}, stacklevel=2)
+
+
+def bind(**fields: Any) -> None:
+    """Add correlation fields to the messages logged in the current context.
+
+    Every asyncio task has its own context, so fields bound
+    while handling a command only apply to that command.
+    """
+
+    _context.set({**_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Add the correlation fields of the context to records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = getattr(record, "fields", None) or {}
+        record.fields = {**_context.get(), **fields}
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop messages logged too often from the same line.
+
+    Every line can log `burst` messages per `interval` seconds.
+    The first message after that notes how many were dropped.
+    """
+
+    def __init__(self, burst: int, interval: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+
+        # Start of the window, messages passed and messages dropped
+        self._lines: dict[tuple, list] = {}
+        self._lock = threading.Lock()
 
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno, record.levelno)
+        now = time.monotonic()
 
-def setup_logger(level: int | None = logging.INFO) -> None:
-    """Setup logger"""
+        with self._lock:
+            line = self._lines.get(key)
+            if line is None or now - line[0] >= self.interval:
+                dropped = line[2] if line else 0
+                self._lines[key] = [now, 1, 0]
+            elif line[1] < self.burst:
+                line[1] += 1
+                return True
+            else:
+                line[2] += 1
+                return False
+
+        if dropped:
+            record.fields = {**getattr(record, "fields", {}), "dropped": dropped}
+
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Format records as text, followed by their correlation fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return text
+
+        pairs = " ".join(f"{key}={value}" for key, value in fields.items())
+        return f"{text} [{pairs}]"
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as JSON lines, with their correlation fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            **(getattr(record, "fields", None) or {}),
+        }
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+def setup_logger(
+    level: int | None = logging.INFO,
+    json_lines: bool = False,
+    burst: int = 0,
+    interval: float = 10.0,
+) -> None:
+    """Setup logger
+
+    Messages are put in a queue and written to stdout by a thread,
+    so a slow output never blocks the event loop or the audio threads.
+    With `burst`, lines logging more than `burst` messages
+    per `interval` seconds are rate limited.
+    """
+
+    global _listener
 
     logger = logging.getLogger("BNSS")
     logger.setLevel(level)
 
     # Setup formatter
     formatting = "[%(asctime)s] [%(name)s] [%(levelname)s] :: %(message)s"
-    formatter = logging.Formatter(formatting, datefmt="%Y-%m-%d %H:%M:%S")
+    if json_lines:
+        formatter = JSONFormatter(datefmt="%Y-%m-%dT%H:%M:%S%z")
+    else:
+        formatter = TextFormatter(formatting, datefmt="%Y-%m-%d %H:%M:%S")
 
-    # Setup stream handler
+    # Setup stream handler, only used by the writer thread
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(formatter)
 
+    # Setup queue handler, the message is formatted before it's queued
+    # so later changes to the logged objects don't show up in it
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(ContextFilter())
+    if burst:
+        queue_handler.addFilter(RateLimitFilter(burst, interval))
+
     # Set logging level to warning
     discord_logger = logging.getLogger("discord")
     discord_logger.setLevel(logging.WARNING)
 
-    # Setup fiscord formatter
-    discord_formatter = logging.Formatter(formatting, datefmt="%Y-%m-%d %H:%M:%S")
+    # Replace the handlers of a previous setup
+    if _listener is not None:
+        _listener.stop()
+
+    for log_ in (logger, discord_logger):
+        for previous in list(log_.handlers):
+            if isinstance(previous, logging.handlers.QueueHandler):
+                log_.removeHandler(previous)
+
+        log_.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    _listener.start()
+
 
-    # Setup discord handler
-    discord_handler = logging.StreamHandler(sys.stdout)
-    discord_handler.setFormatter(discord_formatter)
+@atexit.register
+def _flush() -> None:
+    """Write the messages still in the queue before exiting."""
 
-    # Add handlers
-    logger.addHandler(handler)
-    discord_logger.addHandler(discord_handler)
+    if _listener is not None:
+        _listener.stop()
@@ -1,17 +1,29 @@
+# Imported first, so the startup report includes the other imports.
+# isort would move it below them, which would stop timing them.
+from bnss.startup import STARTUP  # noqa: I001
+
 import asyncio
-from typing import Literal
+import logging
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Literal, Optional
 
 import discord
 from discord.ext import commands
 
+from bnss import metrics
 from bnss.bot import BNSSBot
 from bnss.cogs import EventsCog, VoiceCog
-from bnss.logger import setup_logger
+from bnss.logger import log, setup_logger
+from bnss.settings import Settings, get_settings
 
-bot = BNSSBot()
+# Seconds to wait before restarting a crashed shard process
+RESTART_DELAY = 5
 
 
-@bot.command()
+@commands.command()
 @commands.guild_only()
 @commands.is_owner()
 async def sync(
@@ -61,21 +73,159 @@ async def sync(
     await ctx.send(f"Synced the tree to {ret}/{len(guilds)}.")
 
 
-async def main(bot: BNSSBot):
-    """Initialize the bot."""
+async def main(bot: BNSSBot, index: int = 0):
+    """Initialize the bot.
+
+    `index` is the number of the shard process, when there are several.
+    """
 
     discord.opus.load_opus("libopus.so.0")
 
     # Setup logger for bot and discord
-    setup_logger(bot.settings.log_level)
-
-    # Load cogs
+    setup_logger(
+        bot.settings.log_level,
+        bot.settings.log_json,
+        bot.settings.log_burst,
+        bot.settings.log_burst_interval,
+    )
+    if bot.shard_ids:
+        log(f"Running shards {bot.shard_ids} of {bot.shard_count}.")
+
+    STARTUP.mark("opus")
+
+    # Serve metrics for Prometheus, every process on its own port
+    if bot.settings.metrics_port:
+        await metrics.start_server(
+            bot.settings.metrics_host,
+            bot.settings.metrics_port + index,
+        )
+        STARTUP.mark("metrics")
+
+    # Load commands and cogs
+    bot.add_command(sync)
     await bot.add_cog(EventsCog(bot))
     await bot.add_cog(VoiceCog(bot))
+    STARTUP.mark("cogs")
+
+    # Run bot, the report is logged once every shard is ready
+    await bot.login(bot.settings.token)
+    STARTUP.mark("login")
+
+    report = asyncio.create_task(report_startup(bot))
+    try:
+        await bot.connect()
+    finally:
+        report.cancel()
+
+
+async def report_startup(bot: BNSSBot) -> None:
+    """Log the startup report when the bot is ready."""
+
+    await bot.wait_until_ready()
+    STARTUP.mark("gateway")
+    STARTUP.report()
+
+
+def shard_ranges(settings: Settings) -> list[Optional[list[int]]]:
+    """Split the shards of this container between its processes.
+
+    Returns `[None]` if the bot isn't sharded manually,
+    Discord decides the shards in that case.
+    """
+
+    if not settings.shard_count:
+        return [None]
+
+    count = settings.container_shards or settings.shard_count - settings.shard_offset
+    shards = range(settings.shard_offset, settings.shard_offset + count)
+
+    # Every process gets a contiguous range of shards of about the same size
+    processes = max(1, min(settings.shard_processes, len(shards)))
+    return [
+        list(shards[count * i // processes : count * (i + 1) // processes])
+        for i in range(processes)
+    ]
+
+
+def run_shards(
+    index: int,
+    shard_ids: Optional[list[int]],
+    processes: int = 1,
+) -> None:
+    """Run the bot with some of the shards, in the current process.
+
+    `processes` is the number of processes running the shards of the bot.
+    """
+
+    STARTUP.mark("imports")
+
+    # The audio cache is indexed in memory, so processes can't share it.
+    # Every process gets its own directory and its share of the size.
+    if processes > 1:
+        settings = get_settings()
+        settings.cache_dir = str(Path(settings.cache_dir) / f"process-{index}")
+        settings.cache_max_bytes //= processes
+
+    if shard_ids is None:
+        bot = BNSSBot()
+    else:
+        bot = BNSSBot(shard_ids=shard_ids, shard_count=get_settings().shard_count)
+
+    STARTUP.mark("bot")
+    asyncio.run(main(bot, index))
+
+
+def run() -> None:
+    """Run the bot, in a process for every range of shards.
+
+    Processes that crash are restarted.
+    """
+
+    settings = get_settings()
+    ranges = shard_ranges(settings)
+    if len(ranges) == 1:
+        return run_shards(0, ranges[0])
+
+    setup_logger(
+        settings.log_level,
+        settings.log_json,
+        settings.log_burst,
+        settings.log_burst_interval,
+    )
+
+    context = multiprocessing.get_context("spawn")
+    processes: dict[int, multiprocessing.Process] = {}
+
+    def start(index: int):
+        process = context.Process(
+            target=run_shards,
+            args=(index, ranges[index], len(ranges)),
+            name=f"bnss-shards-{index}",
+        )
+        process.start()
+        processes[index] = process
+
+    for index in range(len(ranges)):
+        start(index)
+
+    while processes:
+        wait([process.sentinel for process in processes.values()])
+
+        for index, process in list(processes.items()):
+            if process.is_alive():
+                continue
+
+            del processes[index]
+            if process.exitcode == 0:
+                continue
 
-    # Run bot
-    await bot.start(bot.settings.token)
+            log(
+                f"Shard process {index} exited with {process.exitcode}, restarting.",
+                level=logging.WARNING,
+            )
+            time.sleep(RESTART_DELAY)
+            start(index)
 
 
 if __name__ == "__main__":
-    asyncio.run(main(bot))
+    run()
@@ -0,0 +1,257 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Union
+
+from bnss.logger import log
+
+Number = Union[int, float]
+Labels = tuple[tuple[str, str], ...]
+
+# Seconds, from a few milliseconds up to a slow download
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes, from a short clip up to the song size limit
+SIZE_BUCKETS = (
+    100_000,
+    500_000,
+    1_000_000,
+    2_500_000,
+    5_000_000,
+    10_000_000,
+    20_000_000,
+)
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: Number) -> str:
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class for metrics exported in the Prometheus text format."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: dict[Labels, Number] = {}
+
+    def inc(self, amount: Number = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """Value read from a callback every time the metrics are scraped.
+
+    The callback returns either a number, or an iterable
+    of `(labels, value)` pairs where `labels` is a dict.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, description: str, callback: Optional[Callable] = None
+    ):
+        super().__init__(name, description)
+        self.callback = callback
+
+    def samples(self) -> Iterator[str]:
+        if self.callback is None:
+            return
+
+        value = self.callback()
+        if isinstance(value, (int, float)):
+            yield f"{self.name} {_format_value(value)}"
+            return
+
+        for labels, number in value:
+            yield f"{self.name}{_format_labels(_labels(labels))} {_format_value(number)}"
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets=TIME_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+
+    def observe(self, value: Number) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the time spent in the block."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels((), ("le", _format_value(bound)))
+            yield f"{self.name}_bucket{labels} {cumulative}"
+
+        yield f"{self.name}_sum {_format_value(total)}"
+        yield f"{self.name}_count {cumulative}"
+
+
+REGISTRY: list[Metric] = []
+
+
+def render() -> str:
+    """Return every metric in the Prometheus text format."""
+
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer a single HTTP request."""
+
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> asyncio.Server:
+    """Serve the metrics on `http://host:port/metrics`."""
+
+    server = await asyncio.start_server(_handle, host, port)
+    log(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+# Hot path metrics
+EXTRACT_SECONDS = Histogram(
+    "bnss_extract_info_seconds",
+    "Time spent extracting song info with yt-dlp.",
+)
+DOWNLOAD_SECONDS = Histogram(
+    "bnss_download_seconds",
+    "Time spent downloading a song.",
+)
+DOWNLOAD_BYTES = Histogram(
+    "bnss_download_bytes",
+    "Size of downloaded songs.",
+    SIZE_BUCKETS,
+)
+FFMPEG_STARTUP_SECONDS = Histogram(
+    "bnss_ffmpeg_startup_seconds",
+    "Time from spawning ffmpeg to its first audio frame.",
+)
+TRANSITION_SECONDS = Histogram(
+    "bnss_song_transition_seconds",
+    "Silence between the end of a song and the first frame of the next.",
+)
+REJECTED_SONGS = Counter(
+    "bnss_rejected_songs_total",
+    "Songs that were too long or too large to be queued.",
+)
+DOWNLOAD_THROTTLED_SECONDS = Counter(
+    "bnss_download_throttled_seconds_total",
+    "Time downloads waited for the bandwidth budgets.",
+)
+
+# State metrics, their callbacks are set by the voice cog
+QUEUE_DEPTH = Gauge(
+    "bnss_queue_depth",
+    "Number of songs in the queue of each guild.",
+)
+VOICE_CLIENTS = Gauge(
+    "bnss_voice_clients",
+    "Number of connected voice clients.",
+)
+BUFFERED_AUDIO_BYTES = Gauge(
+    "bnss_buffered_audio_bytes",
+    "Audio of downloaded songs held in memory or spilled to disk.",
+)
+EXECUTOR_BACKLOG = Gauge(
+    "bnss_executor_backlog",
+    "Download jobs waiting for a worker.",
+)
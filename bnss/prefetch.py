@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Callable, Hashable, Iterable
+
+from bnss.helpers import Song
+from bnss.logger import log
+from bnss.scheduler import DownloadScheduler
+
+
+class Prefetcher:
+    """Download the songs at the front of every guild's queue ahead of time.
+
+    The song at the front of a queue is always downloaded. The next
+    `depth` songs are downloaded while the audio held in memory
+    by all the queues stays below `max_bytes`. Downloads of songs
+    that leave their queue are cancelled.
+    """
+
+    def __init__(self, scheduler: DownloadScheduler, depth: int, max_bytes: int):
+        self.scheduler = scheduler
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+        self._queues: dict[Hashable, tuple[Iterable[Song], Callable]] = {}
+        self._jobs: dict[Hashable, dict[int, tuple[Song, asyncio.Future]]] = {}
+
+    def buffered_bytes(self) -> int:
+        """Return the audio bytes held in memory by all the queues."""
+
+        return sum(song.size for queue, _ in self._queues.values() for song in queue)
+
+    def update(
+        self,
+        guild: Hashable,
+        queue: Iterable[Song],
+        download: Callable[[Song], None],
+    ) -> None:
+        """Schedule the downloads for the next songs of a guild.
+
+        `download` is called from a worker thread with
+        the song to download into its buffer.
+        """
+
+        songs = list(queue)
+        self._queues[guild] = (queue, download)
+        jobs = self._jobs.setdefault(guild, {})
+
+        # Cancel the downloads of songs that aren't queued anymore
+        queued = {id(song) for song in songs}
+        for key in list(jobs):
+            if key not in queued:
+                self._cancel(*jobs.pop(key))
+
+        if not songs:
+            self.forget(guild)
+            return
+
+        for index, song in enumerate(songs[: self.depth + 1]):
+            if song.downloaded or id(song) in jobs:
+                continue
+
+            # Don't retry songs that failed to download
+            if song.stream is not None and song.stream.closed:
+                continue
+
+            # Only the current song may go over the memory budget
+            if index and self.buffered_bytes() >= self.max_bytes:
+                break
+
+            song.buffer()
+            future = self.scheduler.submit(guild, download, song, background=True)
+            future.add_done_callback(
+                lambda f, key=id(song): self._done(guild, key, f),
+            )
+            jobs[id(song)] = (song, future)
+
+    def forget(self, guild: Hashable) -> None:
+        """Cancel all the downloads of a guild."""
+
+        for song, future in self._jobs.pop(guild, {}).values():
+            self._cancel(song, future)
+
+        self._queues.pop(guild, None)
+
+    def _cancel(self, song: Song, future: asyncio.Future) -> None:
+        """Cancel a download, whether it started or not."""
+
+        future.cancel()
+        song.cancel()
+
+    def _done(self, guild: Hashable, key: int, future: asyncio.Future) -> None:
+        """Forget a finished download and schedule the next ones."""
+
+        jobs = self._jobs.get(guild)
+        if jobs is None or key not in jobs:
+            return
+
+        del jobs[key]
+
+        if not future.cancelled() and future.exception():
+            log("Prefetch failed.", future.exception(), level=logging.ERROR)
+
+        if guild in self._queues:
+            self.update(guild, *self._queues[guild])
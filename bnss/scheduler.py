@@ -0,0 +1,164 @@
+import asyncio
+import concurrent.futures
+import contextvars
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Hashable, Optional
+
+
+class DownloadScheduler:
+    """Run blocking download jobs in an executor.
+
+    Jobs are grouped by guild and picked round-robin, so a guild
+    with many pending downloads can't starve the others.
+    Every guild has a foreground lane for the songs it requested
+    and a background lane for prefetches. Only one job per lane
+    runs at a time, which keeps the songs of a guild queued in the
+    order they were requested, and a request never waits for
+    the background download of its guild.
+
+    A job that has to wait for something else than its own work can
+    return a `concurrent.futures.Future`, its worker is freed and the
+    job's future gets the result of that future once it's done.
+    """
+
+    def __init__(self, max_workers: int = 2, executor: Optional[Executor] = None):
+        self.max_workers = max(1, max_workers)
+        self.executor = executor
+
+        # Jobs are keyed by guild and lane, True for the background one
+        self._pending: dict[tuple[Hashable, bool], deque] = {}
+        self._ready: deque = deque()
+        self._running: set = set()
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the worker tasks."""
+
+        if self._workers:
+            return
+
+        for _ in range(self.max_workers):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        """Stop the workers and cancel every pending job."""
+
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+        for jobs in self._pending.values():
+            for future, *_ in jobs:
+                future.cancel()
+
+        self._pending.clear()
+        self._ready.clear()
+        self._running.clear()
+
+    def submit(
+        self,
+        guild: Hashable,
+        func: Callable,
+        *args: Any,
+        background: bool = False,
+    ) -> asyncio.Future:
+        """Schedule `func(*args)` for a guild and return a future for its result.
+
+        The job runs in the context it was submitted from,
+        so it logs with the same correlation fields.
+        """
+
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        lane = (guild, background)
+        jobs = self._pending.setdefault(lane, deque())
+        jobs.append((future, contextvars.copy_context(), func, args))
+
+        # A lane is ready when it has jobs and nothing running
+        if lane not in self._running and len(jobs) == 1:
+            self._ready.append(lane)
+            self._wakeup.set()
+
+        return future
+
+    def pending(self, guild: Hashable) -> int:
+        """Return the number of jobs waiting for a guild."""
+
+        return sum(len(self._pending.get((guild, lane), ())) for lane in (False, True))
+
+    @property
+    def backlog(self) -> int:
+        """Return the number of jobs waiting for a worker."""
+
+        return sum(map(len, self._pending.values()))
+
+    def is_busy(self, guild: Hashable, background: bool = False) -> bool:
+        """Check if a new job in a lane of the guild would have to wait."""
+
+        lane = (guild, background)
+        if lane in self._running or self._pending.get(lane):
+            return True
+
+        return len(self._running) >= self.max_workers
+
+    @staticmethod
+    def _chain(future: asyncio.Future, inner: concurrent.futures.Future) -> None:
+        """Set the result of `future` to the result of `inner` once it's done."""
+
+        def done(inner: asyncio.Future) -> None:
+            if future.done():
+                return
+
+            if inner.cancelled():
+                future.cancel()
+            elif inner.exception() is not None:
+                future.set_exception(inner.exception())
+            else:
+                future.set_result(inner.result())
+
+        asyncio.wrap_future(inner).add_done_callback(done)
+
+    async def _worker(self) -> None:
+        """Pick the next ready lane and run one of its jobs."""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            while not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            lane = self._ready.popleft()
+            jobs = self._pending[lane]
+            future, context, func, args = jobs.popleft()
+
+            self._running.add(lane)
+            try:
+                if not future.cancelled():
+                    result = await loop.run_in_executor(
+                        self.executor, context.run, func, *args
+                    )
+                    if isinstance(result, concurrent.futures.Future):
+                        self._chain(future, result)
+                    elif not future.done():
+                        future.set_result(result)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._running.discard(lane)
+
+                # Put the lane at the back of the line if it has more work
+                if jobs:
+                    self._ready.append(lane)
+                    self._wakeup.set()
+                elif self._pending.get(lane) is jobs:
+                    del self._pending[lane]
@@ -1,6 +1,6 @@
 import logging
 from functools import lru_cache
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,6 +13,112 @@ class Settings(BaseSettings):
     log_level: Optional[int] = logging.INFO
     debug: Optional[bool] = True
 
+    # Write logs as JSON lines, with the guild and request they belong to
+    log_json: Optional[bool] = False
+    # Every line of code logs at most this many messages per interval in seconds,
+    # disabled if 0
+    log_burst: Optional[int] = 20
+    log_burst_interval: Optional[float] = 10.0
+
+    # Prometheus metrics endpoint, disabled if no port is set
+    metrics_host: Optional[str] = "127.0.0.1"
+    metrics_port: Optional[int] = None
+
+    # Sharding. Without a shard count Discord decides it and all shards run
+    # in one process. Otherwise this container runs `container_shards` shards
+    # starting from `shard_offset`, split between `shard_processes` processes.
+    shard_count: Optional[int] = None
+    shard_offset: Optional[int] = 0
+    container_shards: Optional[int] = None
+    shard_processes: Optional[int] = 1
+
+    # Gateway cache, see the README. "music" only caches what the voice
+    # commands need, "full" caches every member, presence and message.
+    # The other settings override the profile, flags are given by name.
+    cache_profile: Optional[Literal["music", "full"]] = "music"
+    intents: Optional[list[str]] = None
+    member_cache_flags: Optional[list[str]] = None
+    chunk_guilds_at_startup: Optional[bool] = None
+    max_messages: Optional[int] = None
+
+    # Player
+    queue_max_size: Optional[int] = 10
+    guild_idle_ttl: Optional[int] = 900
+
+    # Playlists can fill the queue up to this size
+    playlist_max_size: Optional[int] = 500
+
+    # Leave the voice channel after nothing played for this many seconds
+    idle_disconnect_grace: Optional[int] = 120
+
+    # The queues are saved here every `snapshot_interval` seconds
+    # and resumed after a restart, disabled if not set
+    snapshot_dir: Optional[str] = "snapshots"
+    snapshot_interval: Optional[int] = 15
+
+    # Downloads
+    max_downloads: Optional[int] = 2
+
+    # Songs longer than this many seconds or larger than this many bytes
+    # are rejected, and aborted as soon as they go over while downloading.
+    # Disabled if 0.
+    max_song_duration: Optional[int] = 600
+    max_song_bytes: Optional[int] = 20_000_000
+
+    # Download bandwidth in bytes per second of all guilds and of every guild,
+    # unlimited if not set. Up to `download_burst` bytes go through at once.
+    download_rate: Optional[int] = None
+    guild_download_rate: Optional[int] = None
+    download_burst: Optional[int] = 1_000_000
+
+    # Run yt-dlp in this many worker processes instead of threads, 0 to disable.
+    # Workers that don't make progress for the timeout in seconds are restarted.
+    ytdlp_processes: Optional[int] = 0
+    ytdlp_timeout: Optional[int] = 60
+
+    # Start playing before the download is finished
+    stream_playback: Optional[bool] = True
+    stream_prebuffer: Optional[int] = 256_000
+
+    # Download the next songs of the queue while the current one plays
+    prefetch_depth: Optional[int] = 2
+    prefetch_max_bytes: Optional[int] = 200_000_000
+
+    # In-memory cache for extracted song info.
+    # Youtube stream URLs expire after a few hours, so keep the TTL below that.
+    info_cache_size: Optional[int] = 512
+    info_cache_ttl: Optional[int] = 3600
+
+    # Play opus songs without decoding them to PCM
+    opus_passthrough: Optional[bool] = True
+
+    # Normalize the loudness of songs to this many LUFS, disabled if not set.
+    # Every download is measured and normalized songs are decoded instead of
+    # passed through. Songs within the tolerance in dB are played as they are.
+    loudness_target: Optional[float] = None
+    loudness_tolerance: Optional[float] = 1.5
+
+    # Seconds before the end of a song to start decoding the next one,
+    # so they play without a gap. Disabled if 0.
+    gapless_lead: Optional[float] = 5.0
+    # Seconds of crossfade between songs, only when opus_passthrough is off
+    # and numpy is installed, see the README
+    crossfade: Optional[float] = 0.0
+    # Seconds ffmpeg can take to decode a frame before it's killed
+    decoder_timeout: Optional[float] = 30.0
+
+    # Songs are moved to temporary files when the audio
+    # held in memory by all guilds goes over this size
+    audio_max_bytes: Optional[int] = 500_000_000
+    spill_dir: Optional[str] = None
+
+    # Disk cache for downloaded songs, set the size to 0 to disable it
+    cache_dir: Optional[str] = "cache"
+    cache_max_bytes: Optional[int] = 2_000_000_000
+
+    # Catalog of played songs, searched before Youtube. Set it empty to disable it.
+    catalog_path: Optional[str] = "catalog.sqlite3"
+
 
 @lru_cache()
 def get_settings() -> Settings:
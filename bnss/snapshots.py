@@ -0,0 +1,105 @@
+import json
+import threading
+from pathlib import Path
+from typing import Optional
+
+import discord
+
+from bnss.helpers import write_atomic
+from bnss.logger import log
+
+
+class SnapshotStore:
+    """Player state of every guild, saved on disk to survive restarts.
+
+    Every guild is saved in its own small JSON file, replaced
+    atomically so a crash never leaves half of it. Only the songs'
+    metadata is saved, their audio is found again in the audio cache.
+    Guilds whose state didn't change since they were last saved
+    aren't written again.
+
+    Several processes can share the directory, each of them only
+    writes and removes the guilds it saved or resumed.
+    """
+
+    SUFFIX = ".json"
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self._written: dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, guild: int) -> Path:
+        return self.path / f"{guild}{self.SUFFIX}"
+
+    def load(self) -> dict[int, dict]:
+        """Return the saved state of every guild."""
+
+        snapshots = {}
+        for path in self.path.glob(f"*{self.SUFFIX}"):
+            try:
+                snapshots[int(path.stem)] = json.loads(path.read_bytes())
+            except (OSError, ValueError) as e:
+                log("Dropped broken snapshot.", path, e)
+                path.unlink(missing_ok=True)
+
+        return snapshots
+
+    def claim(self, guild: int, snapshot: dict) -> None:
+        """Mark a loaded snapshot as saved by this process."""
+
+        with self._lock:
+            self._written[guild] = self._encode(snapshot)
+
+    def save(self, snapshots: dict[int, dict]) -> int:
+        """Save the state of the guilds that changed, return how many.
+
+        Guilds that were saved before and aren't in `snapshots`
+        anymore are removed.
+        """
+
+        written = 0
+        with self._lock:
+            for guild, snapshot in snapshots.items():
+                data = self._encode(snapshot)
+                if self._written.get(guild) == data:
+                    continue
+
+                write_atomic(self._path(guild), data)
+                self._written[guild] = data
+                written += 1
+
+            for guild in self._written.keys() - snapshots.keys():
+                self._remove(guild)
+
+        return written
+
+    def remove(self, guild: int) -> None:
+        """Forget the state of a guild."""
+
+        with self._lock:
+            self._remove(guild)
+
+    def _remove(self, guild: int) -> None:
+        self._written.pop(guild, None)
+        self._path(guild).unlink(missing_ok=True)
+
+    @staticmethod
+    def _encode(snapshot: dict) -> bytes:
+        return json.dumps(snapshot, separators=(",", ":")).encode()
+
+
+class ResumedContext:
+    """Stand-in for the context of a command, for guilds resumed after a restart.
+
+    Has what the player needs to play songs and send messages.
+    """
+
+    def __init__(self, guild: discord.Guild, channel: discord.abc.Messageable):
+        self.guild = guild
+        self.channel = channel
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        return await self.channel.send(content, **kwargs)
@@ -0,0 +1,38 @@
+import time
+
+from bnss.logger import log
+
+
+class StartupReport:
+    """Time the phases of the startup of the bot.
+
+    The clock starts when this module is imported, which is the
+    first thing `bnss.main` does, so the first phase includes
+    importing the rest of the bot.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+        self._last = self.started
+
+    def mark(self, phase: str) -> None:
+        """End a phase that started when the previous one ended."""
+
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def report(self) -> None:
+        """Log the time spent in every phase."""
+
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases)
+        log(f"Started in {self.total:.3f}s: {phases}.")
+
+
+STARTUP = StartupReport()
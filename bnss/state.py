@@ -0,0 +1,58 @@
+import time
+from typing import Iterator, Optional
+
+from bnss.helpers import SongQueue, VoiceSettings
+
+
+class GuildStates:
+    """Player settings of every guild, keyed by guild ID.
+
+    Settings are created the first time a guild uses the player
+    and every access marks the guild as active. Guilds that were
+    idle for longer than `ttl` seconds can be evicted, so memory
+    grows with the active guilds instead of every guild ever seen.
+    """
+
+    def __init__(self, max_queue: int = 10, ttl: float = 900):
+        self.max_queue = max_queue
+        self.ttl = ttl
+
+        self._states: dict[int, VoiceSettings] = {}
+
+    def __getitem__(self, guild: int) -> VoiceSettings:
+        settings = self._states.get(guild)
+        if settings is None:
+            settings = VoiceSettings(queue=SongQueue(self.max_queue))
+            self._states[guild] = settings
+
+        settings.touch()
+        return settings
+
+    def __contains__(self, guild: int) -> bool:
+        return guild in self._states
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._states)
+
+    def get(self, guild: int) -> Optional[VoiceSettings]:
+        """Return the settings of a guild without creating or touching them."""
+
+        return self._states.get(guild)
+
+    def pop(self, guild: int) -> Optional[VoiceSettings]:
+        """Drop the settings of a guild."""
+
+        return self._states.pop(guild, None)
+
+    def idle(self) -> list[int]:
+        """Return the guilds that weren't active for `ttl` seconds."""
+
+        deadline = time.monotonic() - self.ttl
+        return [
+            guild
+            for guild, settings in self._states.items()
+            if settings.last_active < deadline
+        ]
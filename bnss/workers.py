@@ -0,0 +1,258 @@
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Optional
+
+from bnss.audio import StreamBuffer
+from bnss.logger import log
+
+# How often the download file is checked for new audio
+POLL_INTERVAL = 0.05
+
+
+class WorkerError(Exception):
+    """Raised when a worker fails, hangs or dies while running a job."""
+
+
+def _run_worker(conn: Connection, options: dict) -> None:
+    """Run the jobs sent by the pool until the pipe is closed."""
+
+    from yt_dlp import YoutubeDL
+
+    ytdlp = YoutubeDL(options)
+    flat = YoutubeDL({**options, "extract_flat": "in_playlist"})
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+
+        kind, payload = job
+        try:
+            if kind == "extract":
+                query, listing = payload
+                extractor = flat if listing else ytdlp
+                info = extractor.extract_info(query, download=False)
+                result = YoutubeDL.sanitize_info(info)
+            else:
+                info, path = payload
+                with YoutubeDL({**options, "outtmpl": path, "nopart": True}) as dl:
+                    dl.process_ie_result(info, download=True)
+                result = None
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(("ok", result))
+
+
+class _Worker:
+    """A worker process and the pipe to talk to it."""
+
+    __slots__ = ("process", "conn")
+
+    def __init__(self, context, options: dict):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_run_worker,
+            args=(child, options),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+    def kill(self) -> None:
+        """Stop the process and reap it."""
+
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+class WorkerPool:
+    """Run yt-dlp in worker processes instead of threads.
+
+    yt-dlp spends most of its time in Python code holding the GIL,
+    which competes with the event loop and the audio threads.
+    Every job is sent to an idle worker process and the calling
+    thread blocks until it's done. Downloads are written by the
+    worker to a temporary file, which is read back into the
+    song's buffer as it grows, so the audio is never pickled.
+
+    Workers are started when they are first needed. A worker
+    that dies, or doesn't make progress for `timeout` seconds,
+    is killed and replaced by a new one on the next job.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        timeout: float,
+        options: dict,
+        directory: Optional[str] = None,
+    ):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.directory = directory
+
+        # Workers write to files, never to stdout
+        self.options = {**options, "outtmpl": "%(id)s", "noprogress": True}
+
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def extract(self, query: str, flat: bool = False) -> dict:
+        """Extract the info of a song in a worker.
+
+        If `flat` is set, the entries of a playlist
+        are listed without extracting each of them.
+        """
+
+        worker = self._acquire()
+        try:
+            worker.conn.send(("extract", (query, flat)))
+            if not worker.conn.poll(self.timeout):
+                raise WorkerError(f"Extraction timed out after {self.timeout}s.")
+
+            result = self._result(worker)
+        except BaseException:
+            self._discard(worker)
+            raise
+
+        self._release(worker)
+        return result
+
+    def download(self, info: dict, stream: StreamBuffer) -> None:
+        """Download a song in a worker into `stream`.
+
+        Raises `DownloadCancelled` if the stream is cancelled,
+        the worker is killed in that case.
+        """
+
+        fd, path = tempfile.mkstemp(suffix=".audio", dir=self.directory)
+        os.close(fd)
+
+        worker = self._acquire()
+        try:
+            worker.conn.send(("download", (info, path)))
+            with open(path, "rb") as file:
+                self._follow(worker, file, stream)
+
+            self._result(worker)
+        except BaseException:
+            self._discard(worker)
+            raise
+        finally:
+            os.remove(path)
+
+        self._release(worker)
+
+    def warm_up(self) -> None:
+        """Start a worker ahead of the first job, if none is running."""
+
+        if not self._started:
+            self._release(self._acquire())
+
+    def close(self) -> None:
+        """Stop every idle worker, busy ones are stopped when they finish."""
+
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+
+            self._discard(worker)
+
+    def _follow(self, worker: _Worker, file, stream: StreamBuffer) -> None:
+        """Copy the audio the worker writes to `file` into `stream`."""
+
+        last_progress = time.monotonic()
+        while True:
+            done = worker.conn.poll(POLL_INTERVAL)
+
+            chunk = file.read()
+            if chunk:
+                stream.write(chunk)
+                last_progress = time.monotonic()
+
+            if done:
+                return
+
+            if not worker.process.is_alive():
+                raise WorkerError("Worker died while downloading.")
+
+            if time.monotonic() - last_progress > self.timeout:
+                raise WorkerError(f"Download stalled for {self.timeout}s.")
+
+    def _result(self, worker: _Worker) -> Any:
+        """Return the result of the job the worker just finished."""
+
+        try:
+            status, result = worker.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerError("Worker died while running a job.")
+
+        if status == "error":
+            raise WorkerError(result)
+
+        return result
+
+    def _acquire(self) -> _Worker:
+        """Return an idle worker, starting one if there is room."""
+
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                start = self._started < self.workers
+                if start:
+                    self._started += 1
+
+            if start:
+                break
+
+            # Check for room again in case a busy worker is discarded
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+        try:
+            return _Worker(self._context, self.options)
+        except BaseException:
+            with self._lock:
+                self._started -= 1
+            raise
+
+    def _release(self, worker: _Worker) -> None:
+        """Give a worker back to the pool."""
+
+        if self._closed:
+            return self._discard(worker)
+
+        self._idle.put(worker)
+
+    def _discard(self, worker: _Worker) -> None:
+        """Kill a worker and make room for a new one."""
+
+        worker.kill()
+        log("Stopped yt-dlp worker.", worker.process.pid, level=logging.DEBUG)
+
+        with self._lock:
+            self._started -= 1
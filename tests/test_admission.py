@@ -0,0 +1,131 @@
+import pytest
+
+from bnss import admission
+from bnss.admission import Bandwidth, LimitedStream, SongRejected, TokenBucket
+
+
+class Clock:
+    """Stand-in for the `time` module that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", clock)
+    return clock
+
+
+class Sink:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes) -> int:
+        self.data += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def test_burst_goes_through_at_once(clock):
+    bucket = TokenBucket(rate=100, burst=200)
+
+    assert bucket.reserve(150) == 0.0
+    assert bucket.reserve(50) == 0.0
+    assert not bucket.full
+
+
+def test_large_takes_go_into_debt(clock):
+    bucket = TokenBucket(rate=100, burst=100)
+
+    # Taking more than the bucket holds waits for the difference
+    assert bucket.reserve(300) == pytest.approx(2.0)
+
+    # The next caller waits for the debt to be paid back first
+    assert bucket.reserve(100) == pytest.approx(3.0)
+
+    clock.now = 3.0
+    assert bucket.reserve(0) == 0.0
+
+
+def test_bucket_refills_up_to_its_burst(clock):
+    bucket = TokenBucket(rate=100, burst=100)
+    bucket.reserve(100)
+
+    clock.now = 0.5
+    assert not bucket.full
+    clock.now = 60.0
+    assert bucket.full
+    assert bucket.reserve(150) == pytest.approx(0.5)
+
+
+def test_bandwidth_waits_for_the_slowest_budget(clock):
+    bandwidth = Bandwidth(rate=1000, guild_rate=100, burst=100)
+
+    bandwidth.take("a", 100)
+    bandwidth.take("a", 100)
+    assert clock.slept == [pytest.approx(1.0)]
+
+    # Another guild only shares the global budget
+    bandwidth.take("b", 100)
+    assert len(clock.slept) == 1
+
+
+def test_bandwidth_forgets_idle_guilds(clock):
+    bandwidth = Bandwidth(rate=None, guild_rate=100, burst=100)
+    bandwidth.take("a", 100)
+
+    bandwidth.forget("a")
+    assert "a" in bandwidth._guilds
+
+    clock.now = 10.0
+    bandwidth.forget("a")
+    assert "a" not in bandwidth._guilds
+
+
+def test_unlimited_bandwidth_never_waits(clock):
+    bandwidth = Bandwidth(rate=None, guild_rate=None, burst=100)
+    bandwidth.take("a", 10**9)
+
+    assert clock.slept == []
+
+
+def test_stream_rejects_songs_over_the_size_limit(clock):
+    sink = Sink()
+    bandwidth = Bandwidth(None, None, 100)
+    stream = LimitedStream(sink, {"duration": 60}, "a", bandwidth, 100, 600)
+
+    stream.write(b"x" * 100)
+    with pytest.raises(SongRejected) as e:
+        stream.write(b"x")
+
+    assert e.value.reason == "filesize"
+    assert len(sink.data) == 100
+
+
+def test_stream_estimates_the_duration_from_the_bitrate(clock):
+    bandwidth = Bandwidth(None, None, 100)
+    info = {"abr": 8}
+
+    # 8 kbit/s is 1000 bytes per second, 10 seconds are 10000 bytes
+    stream = LimitedStream(Sink(), info, "a", bandwidth, None, 10)
+    stream.write(b"x" * 10_000)
+    with pytest.raises(SongRejected) as e:
+        stream.write(b"x")
+
+    assert e.value.reason == "duration"
+
+    # Songs with a known duration were checked before the download
+    stream = LimitedStream(Sink(), {**info, "duration": 5}, "a", bandwidth, None, 10)
+    stream.write(b"x" * 20_000)
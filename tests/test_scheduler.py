@@ -0,0 +1,180 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import pytest
+
+from bnss.scheduler import DownloadScheduler
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_guilds_are_served_round_robin():
+    order = []
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=1)
+        futures = [
+            scheduler.submit("a", order.append, "a1"),
+            scheduler.submit("a", order.append, "a2"),
+            scheduler.submit("a", order.append, "a3"),
+            scheduler.submit("b", order.append, "b1"),
+            scheduler.submit("c", order.append, "c1"),
+        ]
+        await asyncio.gather(*futures)
+        await scheduler.stop()
+
+    run(main())
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_jobs_of_a_guild_run_in_order():
+    order = []
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=4)
+        futures = [scheduler.submit("a", order.append, i) for i in range(10)]
+        await asyncio.gather(*futures)
+        await scheduler.stop()
+
+    run(main())
+    assert order == list(range(10))
+
+
+def test_requests_run_beside_the_background_download():
+    release = threading.Event()
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=2)
+        download = scheduler.submit("a", release.wait, 5, background=True)
+        await asyncio.sleep(0.05)
+
+        # The guild's request doesn't wait for its prefetch
+        assert scheduler.is_busy("a", background=True)
+        assert not scheduler.is_busy("a")
+        assert await scheduler.submit("a", lambda: "song") == "song"
+
+        release.set()
+        assert await download is True
+        await scheduler.stop()
+
+    run(main())
+
+
+def test_one_background_download_per_guild():
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def download():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+
+        threading.Event().wait(0.02)
+        with lock:
+            running -= 1
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=4)
+        futures = [scheduler.submit("a", download, background=True) for _ in range(4)]
+        assert scheduler.pending("a") == 4
+        await asyncio.gather(*futures)
+        assert scheduler.backlog == 0
+        await scheduler.stop()
+
+    run(main())
+    assert peak == 1
+
+
+def test_cancelled_jobs_are_skipped():
+    order = []
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=1)
+        first = scheduler.submit("a", order.append, 1)
+        second = scheduler.submit("a", order.append, 2)
+        third = scheduler.submit("a", order.append, 3)
+        second.cancel()
+
+        await asyncio.gather(first, third)
+        await scheduler.stop()
+
+    run(main())
+    assert order == [1, 3]
+
+
+def test_stop_cancels_pending_jobs():
+    release = threading.Event()
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=1)
+        scheduler.submit("a", release.wait, 5)
+        pending = scheduler.submit("b", lambda: None)
+        await asyncio.sleep(0.05)
+
+        await scheduler.stop()
+        release.set()
+        assert pending.cancelled()
+        assert scheduler.backlog == 0
+
+    run(main())
+
+
+def test_errors_are_set_on_the_future():
+    def fail():
+        raise ValueError("broken")
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=1)
+        with pytest.raises(ValueError, match="broken"):
+            await scheduler.submit("a", fail)
+
+        # The guild keeps working after a failed job
+        assert await scheduler.submit("a", lambda: 1) == 1
+        await scheduler.stop()
+
+    run(main())
+
+
+def test_returned_futures_free_the_worker():
+    inner = concurrent.futures.Future()
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=1)
+        waiting = scheduler.submit("a", lambda: inner)
+
+        # The only worker runs the next job while the first one waits
+        assert await scheduler.submit("b", lambda: "next") == "next"
+        assert not waiting.done()
+
+        inner.set_result("shared")
+        assert await waiting == "shared"
+        await scheduler.stop()
+
+    run(main())
+
+
+def test_returned_futures_pass_on_errors_and_cancellation():
+    failed = concurrent.futures.Future()
+    cancelled = concurrent.futures.Future()
+
+    async def main():
+        scheduler = DownloadScheduler(max_workers=1)
+        first = scheduler.submit("a", lambda: failed)
+        second = scheduler.submit("b", lambda: cancelled)
+        await asyncio.sleep(0.05)
+
+        failed.set_exception(ValueError("broken"))
+        cancelled.cancel()
+        with pytest.raises(ValueError, match="broken"):
+            await first
+
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+        await scheduler.stop()
+
+    run(main())
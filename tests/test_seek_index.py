@@ -0,0 +1,105 @@
+from bnss.audio import (
+    EBML_CLUSTER,
+    EBML_CLUSTER_TIMECODE,
+    EBML_INFO,
+    EBML_SEGMENT,
+    EBML_TIMECODE_SCALE,
+    SeekIndex,
+)
+
+EBML_HEADER = 0x1A45DFA3
+SIMPLE_BLOCK = 0xA3
+CUES = 0x1C53BB6B
+UNKNOWN = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+
+
+def element(element_id: int, data: bytes = b"", unknown: bool = False) -> bytes:
+    """Encode an EBML element, with an 8 byte size."""
+
+    header = element_id.to_bytes((element_id.bit_length() + 7) // 8)
+    size = UNKNOWN if unknown else b"\x01" + len(data).to_bytes(7)
+    return header + size + data
+
+
+def cluster(timecode: int, unknown: bool = False) -> bytes:
+    data = element(EBML_CLUSTER_TIMECODE, timecode.to_bytes(2))
+    data += element(SIMPLE_BLOCK, b"\x00" * 32)
+    return element(EBML_CLUSTER, data, unknown)
+
+
+def webm(*parts: bytes, unknown: bool = False) -> bytes:
+    info = element(EBML_INFO, element(EBML_TIMECODE_SCALE, (1_000_000).to_bytes(3)))
+    segment = element(EBML_SEGMENT, info + b"".join(parts), unknown)
+    return element(EBML_HEADER, b"\x42\x86\x81\x01") + segment
+
+
+def cluster_offsets(data: bytes) -> list[int]:
+    marker = EBML_CLUSTER.to_bytes(4)
+    offsets, pos = [], data.find(marker)
+    while pos != -1:
+        offsets.append(pos)
+        pos = data.find(marker, pos + 1)
+
+    return offsets
+
+
+def test_indexes_clusters_by_time():
+    data = webm(cluster(0), cluster(5000), cluster(10000))
+    index = SeekIndex.build(data)
+
+    assert index.times == [0.0, 5.0, 10.0]
+    assert index.offsets == cluster_offsets(data)
+    assert index.header == index.offsets[0]
+
+
+def test_indexes_clusters_of_unknown_size():
+    data = webm(
+        cluster(0, unknown=True),
+        cluster(5000, unknown=True),
+        element(CUES, b"\x00" * 8),
+        unknown=True,
+    )
+    index = SeekIndex.build(data)
+
+    assert index.times == [0.0, 5.0]
+    assert index.offsets == cluster_offsets(data)
+
+
+def test_last_cluster_of_unknown_size_ends_with_the_file():
+    data = webm(cluster(0), cluster(5000, unknown=True), unknown=True)
+
+    assert SeekIndex.build(data).times == [0.0, 5.0]
+
+
+def test_unknown_size_outside_clusters_is_not_indexed():
+    header = element(EBML_HEADER, b"")
+    for info in (
+        element(EBML_INFO, unknown=True),
+        element(EBML_INFO, element(EBML_TIMECODE_SCALE, unknown=True)),
+    ):
+        data = header + element(EBML_SEGMENT, info + cluster(0))
+        assert SeekIndex.build(data) is None
+
+
+def test_unknown_size_inside_a_cluster_is_not_indexed():
+    block = element(SIMPLE_BLOCK, unknown=True)
+    data = webm(cluster(0), element(EBML_CLUSTER, block, unknown=True))
+
+    assert SeekIndex.build(data) is None
+
+
+def test_truncated_or_other_files_are_not_indexed():
+    data = webm(cluster(0), cluster(5000))
+
+    assert SeekIndex.build(data[:30]) is None
+    assert SeekIndex.build(b"ID3\x03\x00" + b"\x00" * 64) is None
+
+
+def test_locate_returns_the_cluster_before_the_position():
+    data = webm(cluster(0), cluster(5000), cluster(10000))
+    index = SeekIndex.build(data)
+    offsets = cluster_offsets(data)
+
+    assert index.locate(7.5) == (offsets[1], 5.0)
+    assert index.locate(10.0) == (offsets[2], 10.0)
+    assert index.locate(-1.0) == (offsets[0], 0.0)